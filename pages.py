@@ -1,4 +1,5 @@
 import logging
+from os import environ
 from re import sub
 from os.path import dirname, join
 from collections import defaultdict
@@ -19,10 +20,28 @@ from google.appengine.ext import webapp
 from google.appengine.ext.webapp import template
 from google.appengine.ext.webapp.util import run_wsgi_app
 
+from voting import cache, stats
 from voting.methods import methods
-from voting.models import Election, Candidate, Vote
+from voting.models import (BallotBucket, BatchLoader, Election, Candidate, PairwiseTally, Result, Vote,
+    cast_vote, migrate_elections, migrate_votes)
 from voting.util import interleave
 
+# The development server shows tabulation statistics on results pages.
+debug = environ.get("SERVER_SOFTWARE", "").startswith("Development")
+
+def describe(score):
+    r'''Formats a minimax score, a candidate's strongest defeat.
+    '''#"""#'''
+    if not score:
+        return "undefeated"
+    return "worst defeat %d to %d" % score
+
+def closed(election):
+    r'''Whether the election has passed its closing time.
+        Closed elections take no more votes, and show their final results.
+    '''#"""#'''
+    return bool(election.closes and election.closes < datetime.now())
+
 class Page(webapp.RequestHandler):
     template_directory = join(dirname(__file__), "html")
     
@@ -58,6 +77,7 @@ class CreatePage(Page):
         "save",
         "list",
         "admin",
+        "tasks",
         "static",
         "favicon.ico",
     ]
@@ -78,6 +98,11 @@ class CreatePage(Page):
             election.title = self.request.get("title").strip() or slug
             election.public = bool(self.request.get("public"))
             
+            try:
+                election.seats = max(int(self.request.get("seats")), 1)
+            except ValueError:
+                election.seats = 1
+            
             default = "Created by " + election.creator.nickname()
             election.description = self.request.get("description").strip() or default
             
@@ -98,6 +123,7 @@ class CreatePage(Page):
             # Consider rolling back if there are two of them after inserting.
             assert not Election.get_by_key_name(slug)
             election.put()
+            PairwiseTally.create(election)
             self.redirect("/%s/candidate" % slug)
         except Exception, err:
             logging.exception("Failed to create election: %r", repr(locals()))
@@ -132,6 +158,7 @@ class CandidatePage(Page):
             candidate.description = self.request.get("description").strip()
             
             candidate.put()
+            cache.bump(election.key().name())
             self.redirect("/%s/candidate" % election.key().name())
         except Exception, err:
             logging.exception("Failed to save candidate: %r", repr(locals()))
@@ -141,14 +168,14 @@ class CandidatePage(Page):
 class VotePage(Page):
     def get(self):
         election = self.election()
-        if not election:
+        if not election or self.refused(election):
             return
         user = users.get_current_user()
         candidates = db.GqlQuery("SELECT * FROM Candidate WHERE ANCESTOR IS :1", election)
         vote = Vote.get_by_key_name(self._vote_key(election, user))
         if vote:
             entries = dict((c.key().id(), c) for c in candidates)
-            keys = [[int(key) for key in rank.split(",")] for rank in vote.ranks.split(";")]
+            keys = vote.rankings()
             ranks = interleave(repeat([]), ([entries[key] for key in rank] for rank in keys))
             unranked = [entries[key] for key in entries if key not in set(sum(keys, []))]
         else:
@@ -158,6 +185,8 @@ class VotePage(Page):
     
     def post(self):
         election = self.election()
+        if not election or self.refused(election):
+            return
         user = users.get_current_user()
         
         # Parse the form input into a reasonable vote set.
@@ -167,21 +196,24 @@ class VotePage(Page):
             if param[0] == "c" and candidate.isdigit():
                 rank = int(self.request.get(param))
                 if rank:
-                    ranks[rank].add(candidate)
-        ranked = ";".join(",".join(sorted(ranks[key])) for key in sorted(ranks))
+                    ranks[rank].add(int(candidate))
         
-        if ranked:
-            # Todo: Use a single transaction for this whole thing,
-            # folding the get_or_insert part into the transaction.
-            vote = Vote.get_or_insert(self._vote_key(election, user),
-                election=election, voter=user, ranks=ranked)
-            if vote.ranks != ranked:
-                vote.ranks = ranked
-                vote.modified = datetime.now()
-                vote.put()
+        if ranks:
+            ranks = [ranks[key] for key in sorted(ranks)]
+            key = self._vote_key(election, user)
+            if cast_vote(election, key, user, ranks):
+                cache.bump(election.key().name())
         
         self.redirect("/%s/results" % election.key().name())
     
+    def refused(self, election):
+        # The final results would silently ignore a late ballot.
+        if closed(election):
+            self.response.set_status(403, 'Forbidden')
+            self.echo("Voting in this election has closed.")
+            return True
+        return False
+    
     def _vote_key(self, election, user):
         return "%s/%s" % (election.key().name(), user.user_id())
 
@@ -198,19 +230,127 @@ class ResultPage(Page):
         except IndexError:
             method = choice(list(voting))
         
+        # Pages that only need the winners can ask for fewer ranks;
+        # anything but a positive count gets the full ordering.
+        try:
+            top = max(int(self.request.get("top")), 0) or None
+        except ValueError:
+            top = None
+        
         candidates = db.GqlQuery("SELECT * FROM Candidate WHERE ANCESTOR IS :1", election)
-        votes = db.GqlQuery("SELECT * FROM Vote WHERE election = :1", election)
         entries = dict((c.key().id(), c) for c in candidates)
-        ballots = [([map(int, rank.split(",")) for rank in vote.ranks.split(";")], 1) for vote in votes]
-        results = (map(entries.get, rank) for rank in voting[method](ballots, entries))
+        
+        collector = stats.Collector()
+        previous = stats.collect(collector)
+        try:
+            if closed(election):
+                # Closed elections are served from their final snapshot.
+                # Until the finalizer takes it, they get the cached live
+                # results, instead of every viewer computing every method.
+                final = Result.get_by_key_name(election.key().name())
+            else:
+                final = None
+            
+            snapshot = final is not None and method in final.methods
+            if snapshot:
+                ranks = final.ordering(method)[:top]
+            else:
+                ranks = self._current(election, entries, voting[method], top)
+        finally:
+            stats.collect(previous)
+        
+        report = collector.report()
+        if report:
+            logging.info("Tabulated %s with %s:\n%s", election.key().name(), method, report)
+        
+        if voting[method].scores and not snapshot:
+            # Live scores could disagree with a snapshot's ranks.
+            scores = self._scores(election, entries, voting[method])
+            for key in scores:
+                if key in entries:
+                    entries[key].score = describe(scores[key])
+        
+        results = (map(entries.get, rank) for rank in ranks)
         methodnames = [(methods[key].__name__, key) for key in methods]
-        self.render("election.html", election=election, ranks=results, methods=methodnames, method=method)
+        self.render("election.html", election=election, ranks=results, methods=methodnames, method=method,
+            stats=debug and report)
+    
+    def _tally(self, election, entries, method):
+        done = stats.phase("load")
+        if method.pairwise:
+            # The stored pairwise counts are enough for this method.
+            ballots = PairwiseTally.load(election, entries)
+        else:
+            ballots = BallotBucket.load(election, entries)
+        done()
+        return ballots
+    
+    def _scores(self, election, entries, method):
+        def compute():
+            return method.scores(self._tally(election, entries, method), entries)
+        return cache.scores(election.key().name(), method.__name__, compute)
+    
+    def _current(self, election, entries, method, top=None):
+        options = {}
+        if method.multiwinner:
+            options["seats"] = election.seats
+        
+        def compute():
+            ballots = self._tally(election, entries, method)
+            done = stats.phase("method." + method.__name__)
+            ranks = list(method(ballots, entries, top=top, **options))
+            done()
+            return ranks
+        
+        name = method.__name__
+        if method.multiwinner:
+            name += ":seats%d" % election.seats
+        if top is not None:
+            name += ":top%d" % top
+        return cache.results(election.key().name(), name, compute)
+
+class FinalizePage(Page):
+    r'''Stores the final results of recently closed elections.
+        Run periodically by cron; see cron.yaml.
+    '''#"""#'''
+    batch = 20
+    
+    def get(self):
+        now = datetime.now()
+        # Elections stored before the finalized property existed lack it
+        # entirely, until migrate_elections() fills it in.
+        query = Election.all().filter("finalized =", False).filter("closes <", now)
+        count = tried = 0
+        for election in BatchLoader(query):
+            if tried >= self.batch:
+                break
+            tried += 1
+            try:
+                Result.finalize(election)
+                count += 1
+            except Exception:
+                # Leave it for the next run, instead of blocking the rest.
+                logging.exception("Failed to finalize %s", election.key().name())
+        self.echo("Finalized %d elections.", count)
+
+class MigratePage(Page):
+    r'''Moves votes from the older ranks property into the list properties,
+        and fills in the finalized flag on older elections, a few batches
+        per request.  Run periodically by cron until the migrations
+        finish; see cron.yaml.
+    '''#"""#'''
+    def get(self):
+        # Elections are few, so their share of the request can be small.
+        self.echo("%s\n", migrate_elections(budget=5))
+        self.echo("%s", migrate_votes(budget=15))
 
 webapp.template.register_template_library("voting.filters")
 application = webapp.WSGIApplication([
         ("/", MainPage),
         ("/create", CreatePage),
         ("/list", ListPage),
+        ("/tasks/finalize", FinalizePage),
+        ("/tasks/migrate", MigratePage),
         ("/[\w.-]+/candidate", CandidatePage),
         ("/[\w.-]+/vote", VotePage),
         ("/[\w.-]+/results", ResultPage),
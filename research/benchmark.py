@@ -0,0 +1,121 @@
+r'''Timing and memory benchmark for the registered voting methods.
+    Runs every method over synthetic elections across a grid of
+    candidate and ballot counts, and writes a JSON report:
+        
+        python benchmark.py [report.json] [--quick]
+    
+    Each measurement runs in a forked child process, so that peak memory
+    is reported per method and a slow method can be cut off by timeout.
+'''#"""#'''
+
+import json
+import marshal
+import os
+import platform
+import resource
+import signal
+import sys
+from time import time
+
+from generators import election, models
+from voting.methods import Tally, methods
+
+candidate_counts = [3, 5, 8, 12, 20]
+ballot_counts = [100, 1000, 10000]
+quick_candidates = [3, 8]
+quick_ballots = [100, 1000]
+timeout = 60
+seed = 1
+
+def peak_memory():
+    # Linux reports kilobytes; Mac OS X reports bytes.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024
+    return peak
+
+def measure(method, votes, candidates):
+    r'''Runs one method on a fresh Tally in a child process.
+        Returns a dictionary of seconds, peak memory in kilobytes,
+        and the memory growth during the run, or an error.
+    '''#"""#'''
+    reader, writer = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(reader)
+        try:
+            signal.alarm(timeout)
+            before = peak_memory()
+            start = time()
+            list(method(Tally(votes, candidates), candidates))
+            seconds = time() - start
+            result = {"seconds": seconds, "peak_kb": peak_memory(),
+                "growth_kb": peak_memory() - before}
+        except Exception, err:
+            result = {"error": repr(err)}
+        os.write(writer, marshal.dumps(result))
+        os._exit(0)
+    
+    os.close(writer)
+    data = ""
+    while True:
+        chunk = os.read(reader, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(reader)
+    pid, status = os.waitpid(pid, 0)
+    if not data:
+        if os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGALRM:
+            return {"error": "timed out"}
+        return {"error": "exit status %d" % status}
+    return marshal.loads(data)
+
+def run(candidates=candidate_counts, ballots=ballot_counts, names=None, log=sys.stderr):
+    r'''Benchmarks the methods over every model and size in the grid.
+        Returns a list of result dictionaries.
+    '''#"""#'''
+    if names is None:
+        names = sorted(methods)
+    results = []
+    for model in sorted(models):
+        for size in candidates:
+            for count in ballots:
+                keys, votes = election(model, size, count, seed)
+                for name in names:
+                    result = measure(methods[name], votes, keys)
+                    result.update(model=model, candidates=size, ballots=count,
+                        method=methods[name].__name__)
+                    results.append(result)
+                    if log:
+                        log.write("%s %dx%d %s: %s\n" % (model, size, count, name,
+                            result.get("error") or "%.4fs" % result["seconds"]))
+    return results
+
+def main(args):
+    quick = "--quick" in args
+    args = [arg for arg in args if arg != "--quick"]
+    filename = args and args[0] or "benchmark.json"
+    
+    if quick:
+        results = run(quick_candidates, quick_ballots)
+    else:
+        results = run()
+    
+    report = {
+        "created": time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "timeout": timeout,
+        "seed": seed,
+        "results": results,
+    }
+    
+    output = open(filename, "w")
+    try:
+        json.dump(report, output, indent=1, sort_keys=True)
+    finally:
+        output.close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
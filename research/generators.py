@@ -0,0 +1,97 @@
+r'''Synthetic elections drawn from standard preference models.
+    Each model is a function of (candidates, rng) returning one ballot,
+    as a list of ranks, each a list of candidate keys.
+    Use election() to draw a whole set of ballots from one of them.
+'''#"""#'''
+
+from math import sqrt
+from random import Random
+
+def impartial(candidates, rng):
+    r'''Impartial culture: every strict ordering is equally likely.
+    '''#"""#'''
+    order = list(candidates)
+    rng.shuffle(order)
+    return [[key] for key in order]
+
+def mallows(candidates, rng, phi=0.5):
+    r'''Mallows model: orderings become less likely the further they are,
+        in swapped pairs, from the reference ordering of `candidates`.
+        `phi` near zero concentrates on the reference; one is impartial.
+        Sampled by repeated insertion.
+    '''#"""#'''
+    order = []
+    for n, key in enumerate(candidates):
+        # Inserting at position j from the end costs j swaps.
+        weights = [phi ** j for j in range(n + 1)]
+        pick = rng.random() * sum(weights)
+        for j, weight in enumerate(weights):
+            pick -= weight
+            if pick < 0:
+                break
+        order.insert(n - j, key)
+    return [[key] for key in order]
+
+def spatial(candidates, rng, positions):
+    r'''Spatial model: voters and candidates are points in a unit cube,
+        and each voter ranks candidates by Euclidean distance.
+        `positions` fixes the candidate points, as a dictionary of
+        key => coordinates; spatial_model() draws them once per election.
+        Candidates at equal distances share a rank.
+    '''#"""#'''
+    dimensions = len(positions[candidates[0]])
+    voter = [rng.random() for d in range(dimensions)]
+    distances = {}
+    for key in candidates:
+        distance = sqrt(sum((a - b) ** 2 for a, b in zip(voter, positions[key])))
+        distances.setdefault(round(distance, 9), []).append(key)
+    return [distances[distance] for distance in sorted(distances)]
+
+def spatial_model(candidates, rng, dimensions=2):
+    r'''Places the candidates for a spatial election,
+        returning a model function with the positions fixed.
+    '''#"""#'''
+    positions = dict((key, [rng.random() for d in range(dimensions)])
+        for key in candidates)
+    def model(candidates, rng):
+        return spatial(candidates, rng, positions)
+    return model
+
+def truncated(model, keep=0.7, ties=0.2):
+    r'''Wraps another model to produce partial ballots.
+        After each rank, the voter stops with probability 1 - `keep`,
+        and merges the next candidate into the same rank with
+        probability `ties`.  The first rank is always kept.
+    '''#"""#'''
+    def partial(candidates, rng):
+        ballot = []
+        for rank in model(candidates, rng):
+            if ballot:
+                if rng.random() > keep:
+                    break
+                if rng.random() < ties:
+                    ballot[-1].extend(rank)
+                    continue
+            ballot.append(list(rank))
+        return ballot
+    return partial
+
+models = {
+    "impartial": lambda candidates, rng: impartial,
+    "mallows": lambda candidates, rng: mallows,
+    "spatial": spatial_model,
+    "truncated": lambda candidates, rng: truncated(impartial),
+    "truncated-spatial": lambda candidates, rng: truncated(spatial_model(candidates, rng)),
+}
+
+def election(name, candidates, ballots, seed=None):
+    r'''Draws a set of ballots from one of the named models.
+        `candidates` is the number of candidates, keyed from zero.
+        Returns the candidate list and the votes,
+        as a list of (ranks, count) ballots suitable for any method.
+    '''#"""#'''
+    rng = Random(seed)
+    keys = range(candidates)
+    model = models[name](keys, rng)
+    votes = [(model(keys, rng), 1) for n in range(ballots)]
+    return keys, votes
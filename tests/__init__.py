@@ -49,12 +49,21 @@ def setup():
     dev_appserver.SetupStubs(config.application, **option_dict)
 
 class VotingTestCase(unittest.TestCase):
+    # The chance that the datastore applies a write before a query
+    # outside its entity group; one keeps every query consistent.
+    consistency = 1
+    
     def setUp(self):
+        from google.appengine.datastore import datastore_stub_util
         from google.appengine.ext import testbed
         self.logout()
         self.testbed = testbed.Testbed()
         self.testbed.activate()
-        self.testbed.init_datastore_v3_stub()
+        
+        # Cross-group transactions need the High Replication datastore.
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=self.consistency)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
     
     def login(self, email="test@somewhere.com", admin=False):
         from os import environ
@@ -81,3 +90,36 @@ class VotingTestCase(unittest.TestCase):
                 del environ[field]
             except KeyError:
                 pass
+
+class ContestTestCase(VotingTestCase):
+    r'''Tests on one election, "abcd", with a stored tally.
+        `closes` is its closing time in days from now, if any.
+        Tests may replace models.randrange to choose the shards.
+    '''#"""#'''
+    closes = None
+    
+    def setUp(self):
+        from voting import models
+        super(ContestTestCase, self).setUp()
+        self.contest = self.election("abcd", self.closes)
+        models.PairwiseTally.create(self.contest)
+        self.randrange = models.randrange
+    
+    def tearDown(self):
+        from voting import models
+        models.randrange = self.randrange
+        super(ContestTestCase, self).tearDown()
+    
+    def election(self, slug, closes=None):
+        from datetime import datetime, timedelta
+        from voting.models import Election
+        election = Election(key_name=slug, title="Yet another contest")
+        if closes is not None:
+            election.closes = datetime.now() + timedelta(days=closes)
+        election.put()
+        return election
+    
+    def cast(self, n, ranks):
+        from voting.models import cast_vote
+        user = self.login("voter%d@somewhere.com" % n)
+        return cast_vote(self.contest, "abcd/%d" % n, user, ranks)
@@ -0,0 +1,52 @@
+from google.appengine.api import memcache
+from tests import VotingTestCase
+from voting import cache
+
+class ResultsCacheTestCase(VotingTestCase):
+    def compute(self):
+        self.computed += 1
+        return [set([1]), set([2, 3])]
+    
+    def setUp(self):
+        super(ResultsCacheTestCase, self).setUp()
+        self.computed = 0
+    
+    def test_cached(self):
+        first = cache.results("abcd", "plurality", self.compute)
+        second = cache.results("abcd", "plurality", self.compute)
+        self.assertEqual([[1], [2, 3]], first)
+        self.assertEqual(first, second)
+        self.assertEqual(1, self.computed)
+    
+    def test_methods_separate(self):
+        cache.results("abcd", "plurality", self.compute)
+        cache.results("abcd", "borda", self.compute)
+        self.assertEqual(2, self.computed)
+    
+    def test_bumped(self):
+        before = cache.version("abcd")
+        cache.results("abcd", "plurality", self.compute)
+        cache.bump("abcd")
+        self.assertNotEqual(before, cache.version("abcd"))
+        cache.results("abcd", "plurality", self.compute)
+        self.assertEqual(2, self.computed)
+    
+    def test_stale_while_locked(self):
+        # Another request is recounting the new version;
+        # serve the old results instead of recounting again.
+        cache.results("abcd", "plurality", self.compute)
+        cache.bump("abcd")
+        key = "results:abcd:plurality:%s" % cache.version("abcd")
+        memcache.add("lock:" + key, 1)
+        self.assertEqual([[1], [2, 3]], cache.results("abcd", "plurality", self.compute))
+        self.assertEqual(1, self.computed)
+    
+    def test_scores(self):
+        # Scores keep their own values, apart from the method's ranks.
+        def compute():
+            self.computed += 1
+            return {1: None, 2: (2, 1)}
+        cache.results("abcd", "minimax", self.compute)
+        self.assertEqual({1: None, 2: (2, 1)}, cache.scores("abcd", "minimax", compute))
+        self.assertEqual({1: None, 2: (2, 1)}, cache.scores("abcd", "minimax", compute))
+        self.assertEqual(2, self.computed)
@@ -0,0 +1,43 @@
+from tests import VotingTestCase
+from voting.codec import decode, encode, marker, read
+
+class CodecTestCase(VotingTestCase):
+    def test_round_trip(self):
+        ranks = [[12, 15], [9], [300, 70000, 2**40]]
+        self.assertEqual(ranks, decode(encode(ranks)))
+    
+    def test_compact(self):
+        # One byte per small id and per rank break, plus the marker.
+        self.assertEqual(marker + "\x0c\x0f\x00\x09", encode([[12, 15], [9]]))
+    
+    def test_multibyte(self):
+        self.assertEqual(marker + "\x80\x01", encode([[128]]))
+        self.assertEqual([[128]], decode(marker + "\x80\x01"))
+    
+    def test_normalized(self):
+        # Equivalent rankings encode identically.
+        self.assertEqual(encode([[9], [15, 12]]), encode([(9,), [], set([12, 15])]))
+    
+    def test_empty(self):
+        self.assertEqual([], decode(encode([])))
+    
+    def test_invalid_id(self):
+        self.assertRaises(ValueError, encode, [[0]])
+    
+    def test_truncated(self):
+        self.assertRaises(ValueError, decode, marker + "\x80")
+    
+    def test_unmarked(self):
+        self.assertRaises(ValueError, decode, "12,15;9")
+    
+    def test_read_text(self):
+        self.assertEqual([[12, 15], [9]], read("12,15;9"))
+        self.assertEqual([[12, 15], [9]], read(u"12,15;9"))
+    
+    def test_read_binary(self):
+        self.assertEqual([[12, 15], [9]], read(encode([[12, 15], [9]])))
+    
+    def test_shorter(self):
+        ranks = [range(1000, 1010), range(200000, 200005)]
+        text = ";".join(",".join(map(str, rank)) for rank in ranks)
+        self.assertTrue(len(encode(ranks)) < len(text))
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+from google.appengine.api import datastore
+from voting.methods import methods
+from voting.models import Candidate, Election, Result, Vote, migrate_elections
+from pages import FinalizePage, application
+from tests import ContestTestCase
+from webtest import TestApp
+
+class FinalizeTestCase(ContestTestCase):
+    closes = -1
+    
+    def setUp(self):
+        super(FinalizeTestCase, self).setUp()
+        self.candidates = []
+        for title in ["Favorite", "Middling", "Underdog"]:
+            candidate = Candidate(title=title, parent=self.contest)
+            candidate.put()
+            self.candidates.append(candidate.key().id())
+        
+        first, second, third = self.candidates
+        self.cast(1, [[first], [second], [third]])
+        self.cast(2, [[first], [third], [second]])
+        self.app = TestApp(application)
+    
+    def finalize(self):
+        self.login(admin=True)
+        response = self.app.get("/tasks/finalize")
+        self.logout()
+        return response
+    
+    def test_closed_finalized(self):
+        self.finalize()
+        result = Result.get_by_key_name("abcd")
+        self.assertIsNotNone(result)
+        self.assertEqual(sorted(method.__name__ for method in methods.itervalues()),
+            sorted(result.methods))
+        self.assertTrue(Election.get_by_key_name("abcd").finalized)
+    
+    def test_orderings(self):
+        self.finalize()
+        result = Result.get_by_key_name("abcd")
+        first, second, third = self.candidates
+        self.assertEqual([[first], [second, third]], result.ordering("plurality"))
+    
+    def test_snapshot_unscored(self):
+        # Scores are computed live, so snapshot pages go without them.
+        self.finalize()
+        response = self.app.get("/abcd/results/minimax")
+        self.assertIn("Favorite", response)
+        self.assertNotIn("undefeated", response)
+    
+    def test_seats(self):
+        # With two seats, the Favorite wins one outright, instead of
+        # losing the only one to the Middling candidate's transfers.
+        first, second, third = self.candidates
+        self.cast(3, [[second]])
+        self.cast(4, [[second]])
+        self.cast(5, [[third], [second]])
+        self.contest.seats = 2
+        self.contest.put()
+        self.finalize()
+        result = Result.get_by_key_name("abcd")
+        self.assertEqual([[first, second], [third]], result.ordering("stv"))
+    
+    def test_open_unfinalized(self):
+        self.election("efgh", closes=+1)
+        self.finalize()
+        self.assertIsNone(Result.get_by_key_name("efgh"))
+        self.assertFalse(Election.get_by_key_name("efgh").finalized)
+    
+    def test_finalized_once(self):
+        self.finalize()
+        computed = Result.get_by_key_name("abcd").computed
+        response = self.finalize()
+        self.assertIn("Finalized 0 elections", response)
+        self.assertEqual(computed, Result.get_by_key_name("abcd").computed)
+    
+    def test_votes_refused(self):
+        # The snapshot would silently ignore ballots cast after closing.
+        self.finalize()
+        first, second, third = self.candidates
+        self.login("voter3@somewhere.com")
+        self.app.get("/abcd/vote", status=403)
+        response = self.app.post("/abcd/vote", {"c%d" % third: "1"}, status=403)
+        self.assertIn("closed", response)
+        self.assertEqual(2, Vote.all().count())
+        response = self.app.get("/abcd/results/plurality")
+        self.assertLess(response.body.index("Favorite"), response.body.index("Underdog"))
+    
+    def test_results_before_finalize(self):
+        # Until cron takes the snapshot, the live results are served.
+        response = self.app.get("/abcd/results/plurality")
+        self.assertIn("Favorite", response)
+        self.assertIsNone(Result.get_by_key_name("abcd"))
+    
+    def test_historic(self):
+        # Elections stored before the finalized property get finalized
+        # once the migration fills it in.
+        entity = datastore.Entity("Election", name="old")
+        entity["title"] = u"An older contest"
+        entity["closes"] = datetime.now() - timedelta(days=30)
+        datastore.Put(entity)
+        self.finalize()
+        self.assertIsNone(Result.get_by_key_name("old"))
+        
+        self.assertEqual(1, migrate_elections(pause=0).migrated)
+        self.finalize()
+        self.assertIsNotNone(Result.get_by_key_name("old"))
+        self.assertTrue(Election.get_by_key_name("old").finalized)
+    
+    def test_batch(self):
+        self.election("efgh", closes=-2)
+        FinalizePage.batch, batch = 1, FinalizePage.batch
+        try:
+            self.assertIn("Finalized 1 elections", self.finalize())
+            self.assertIn("Finalized 1 elections", self.finalize())
+            self.assertIn("Finalized 0 elections", self.finalize())
+        finally:
+            FinalizePage.batch = batch
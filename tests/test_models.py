@@ -0,0 +1,243 @@
+from threading import Thread
+from voting import cache, models
+from voting.models import (BallotBucket, BatchLoader, Election, PairwiseTally, TallyShard, Vote,
+    migrate_votes, vote_loader)
+from tests import ContestTestCase
+
+class BatchLoaderTestCase(ContestTestCase):
+    def setUp(self):
+        super(BatchLoaderTestCase, self).setUp()
+        for n in range(7):
+            user = self.login("voter%d@somewhere.com" % n)
+            Vote(key_name="abcd/%d" % n, election=self.contest, voter=user,
+                ranks="%d;%d" % (n % 2 + 1, 2 - n % 2)).put()
+    
+    def test_all_loaded(self):
+        votes = vote_loader(self.contest, size=3)
+        ranks = sorted(vote.ranks for vote in votes)
+        self.assertEqual(["1;2"] * 4 + ["2;1"] * 3, ranks)
+    
+    def test_round_trips(self):
+        votes = vote_loader(self.contest, size=3)
+        list(votes)
+        self.assertEqual(3, votes.trips)
+    
+    def test_exact_batches(self):
+        # A full last batch takes one more trip to find the end.
+        votes = vote_loader(self.contest, size=7)
+        list(votes)
+        self.assertEqual(2, votes.trips)
+    
+    def test_other_elections(self):
+        other = Election(key_name="efgh", title="Another contest")
+        other.put()
+        self.assertEqual([], list(vote_loader(other)))
+    
+    def test_entities(self):
+        loader = BatchLoader(Election.all(), size=1)
+        self.assertEqual(["abcd"], [election.key().name() for election in loader])
+        self.assertEqual(2, loader.trips)
+    
+    def test_rebuild(self):
+        BatchLoader.size, size = 2, BatchLoader.size
+        try:
+            tally = PairwiseTally.rebuild(self.contest)
+        finally:
+            BatchLoader.size = size
+        self.assertEqual(7, tally.ballots)
+        self.assertEqual(4, tally.matrix()[1, 2])
+        self.assertEqual(3, tally.matrix()[2, 1])
+
+class MigrationTestCase(ContestTestCase):
+    def setUp(self):
+        super(MigrationTestCase, self).setUp()
+        user = self.login()
+        for n in range(5):
+            Vote(key_name="abcd/%d" % n, election=self.contest, voter=user,
+                ranks="3,%d;1" % (n + 4)).put()
+        vote = Vote(key_name="abcd/new", election=self.contest, voter=user)
+        vote.store([[2], [1, 3]])
+        vote.put()
+    
+    def test_rankings(self):
+        self.assertEqual([[3, 4], [1]], Vote.get_by_key_name("abcd/0").rankings())
+        self.assertEqual([[2], [1, 3]], Vote.get_by_key_name("abcd/new").rankings())
+    
+    def test_migrated(self):
+        progress = migrate_votes(size=4, pause=0)
+        self.assertTrue(progress.finished)
+        self.assertEqual(6, progress.scanned)
+        self.assertEqual(5, progress.migrated)
+        vote = Vote.get_by_key_name("abcd/2")
+        self.assertIsNone(vote.ranks)
+        self.assertEqual([3, 6, 1], vote.choices)
+        self.assertEqual([2, 1], vote.groups)
+        self.assertEqual([[3, 6], [1]], vote.rankings())
+    
+    def test_resumed(self):
+        # Without any time left, each call handles a single batch.
+        progress = migrate_votes(size=4, budget=0, pause=0)
+        self.assertFalse(progress.finished)
+        self.assertEqual(4, progress.scanned)
+        progress = migrate_votes(size=4, budget=0, pause=0)
+        self.assertTrue(progress.finished)
+        self.assertEqual(6, progress.scanned)
+        self.assertEqual(0, Vote.all().filter("ranks !=", None).count())
+    
+    def test_finished(self):
+        migrate_votes(pause=0)
+        Vote(key_name="abcd/late", election=self.contest, voter=self.login(), ranks="1").put()
+        progress = migrate_votes(pause=0)
+        self.assertEqual(6, progress.scanned)
+        self.assertEqual("1", Vote.get_by_key_name("abcd/late").ranks)
+    
+    def test_queryable(self):
+        migrate_votes(pause=0)
+        self.assertEqual(1, Vote.all().filter("choices =", 5).count())
+    
+    def test_rebuild_mixed(self):
+        migrate_votes(size=4, budget=0, pause=0)
+        tally = PairwiseTally.rebuild(self.contest)
+        self.assertEqual(6, tally.ballots)
+        self.assertEqual(5, tally.matrix()[3, 1])
+        self.assertEqual(1, tally.matrix()[2, 1])
+
+class ShardTestCase(ContestTestCase):
+    def test_merged(self):
+        for n in range(30):
+            self.cast(n, [[1], [2, 3]])
+        tally = PairwiseTally.current(self.contest)
+        self.assertEqual(30, tally.ballots)
+        self.assertEqual(30, tally.matrix()[1, 2])
+        self.assertEqual(0, tally.matrix()[2, 3])
+        self.assertTrue(len(TallyShard.all_shards(self.contest)) > 1)
+    
+    def test_turnout(self):
+        for n in range(5):
+            self.cast(n, [[n % 3 + 1]])
+        self.assertEqual(5, PairwiseTally.turnout(self.contest))
+    
+    def test_changed_across_shards(self):
+        # A changed vote removes its earlier ballot through another shard.
+        models.randrange = lambda shards: 0
+        self.assertTrue(self.cast(1, [[1], [2]]))
+        models.randrange = lambda shards: 1
+        self.assertTrue(self.cast(1, [[2], [1]]))
+        
+        first, second = TallyShard.get_by_key_name(["abcd/0", "abcd/1"])
+        self.assertEqual(1, first.ballots)
+        self.assertEqual(0, second.ballots)
+        self.assertEqual(-1, second.matrix()[1, 2])
+        
+        tally = PairwiseTally.current(self.contest)
+        self.assertEqual(1, tally.ballots)
+        self.assertEqual(0, tally.matrix()[1, 2])
+        self.assertEqual(1, tally.matrix()[2, 1])
+        
+        ballots = BallotBucket.load(self.contest, [1, 2])
+        self.assertEqual([(((2,), (1,)), 1)], list(ballots))
+    
+    def test_long_ballot(self):
+        # Ranks past the 500 characters allowed in key names and indexed
+        # strings still fit in a bucket.
+        keys = [10**15 + n for n in range(40)]
+        self.assertTrue(self.cast(1, [[key] for key in keys]))
+        ballots = BallotBucket.load(self.contest, keys)
+        self.assertEqual([(tuple((key,) for key in keys), 1)], list(ballots))
+    
+    def test_unchanged(self):
+        self.assertTrue(self.cast(1, [[1], [2]]))
+        self.assertFalse(self.cast(1, [[1], [2]]))
+        self.assertEqual(1, PairwiseTally.turnout(self.contest))
+    
+    def test_vote_stored(self):
+        self.cast(1, [[2, 1], [3]])
+        vote = Vote.get_by_key_name("abcd/1")
+        self.assertEqual([[1, 2], [3]], vote.rankings())
+    
+    def test_cached(self):
+        self.cast(1, [[1], [2]])
+        PairwiseTally.current(self.contest)
+        # Without a version bump, the merged counts are served from memcache.
+        self.cast(2, [[1], [2]])
+        self.assertEqual(1, PairwiseTally.turnout(self.contest))
+        cache.bump("abcd")
+        self.assertEqual(2, PairwiseTally.turnout(self.contest))
+    
+    def test_uncounted(self):
+        # Elections without a stored tally rebuild it from the votes.
+        PairwiseTally.get_by_key_name("abcd").delete()
+        self.cast(1, [[1], [2]])
+        self.assertEqual([], TallyShard.all_shards(self.contest))
+        self.assertEqual(1, PairwiseTally.turnout(self.contest))
+    
+    def test_rebuild_clears(self):
+        self.cast(1, [[1], [2]])
+        PairwiseTally.rebuild(self.contest)
+        self.assertEqual([], TallyShard.all_shards(self.contest))
+        self.assertEqual(1, PairwiseTally.turnout(self.contest))
+    
+    def test_concurrent(self):
+        # Simultaneous voters, some sharing shards; transactions that
+        # collide are retried, so every vote is counted exactly once.
+        models.randrange = lambda shards: self.randrange(3)
+        errors = []
+        def voter(n):
+            try:
+                self.cast(n, [[1 + n % 2], [2 - n % 2]])
+            except Exception, err:
+                errors.append(err)
+        threads = [Thread(target=voter, args=(n,)) for n in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual([], errors)
+        tally = PairwiseTally.current(self.contest)
+        self.assertEqual(12, tally.ballots)
+        self.assertEqual(6, tally.matrix()[1, 2])
+        self.assertEqual(6, tally.matrix()[2, 1])
+
+class ConsistencyTestCase(ContestTestCase):
+    # Queries outside an entity group never see unapplied writes.
+    consistency = 0
+    
+    def test_loaded(self):
+        # A recount right after voting sees the replaced ballot's bucket.
+        models.randrange = lambda shards: 0
+        self.assertTrue(self.cast(1, [[1], [2]]))
+        ballots = BallotBucket.load(self.contest, [1, 2])
+        self.assertEqual([(((1,), (2,)), 1)], list(ballots))
+        
+        models.randrange = lambda shards: 1
+        self.assertTrue(self.cast(1, [[2], [1]]))
+        ballots = BallotBucket.load(self.contest, [1, 2])
+        self.assertEqual([(((2,), (1,)), 1)], list(ballots))
+    
+    def test_rebuild_concurrent(self):
+        # A vote cast while a rebuild scans the votes, too late for the
+        # query to see it, is counted through a shard instead.
+        PairwiseTally.get_by_key_name("abcd").delete()
+        loader = models.vote_loader
+        def scanning(election):
+            votes = loader(election)
+            self.cast(1, [[2], [1]])
+            return votes
+        models.vote_loader = scanning
+        try:
+            PairwiseTally.fetch(self.contest)
+        finally:
+            models.vote_loader = loader
+        tally = PairwiseTally.current(self.contest)
+        self.assertEqual(1, tally.ballots)
+        self.assertEqual(1, tally.matrix()[2, 1])
+    
+    def test_cleared(self):
+        for n in range(5):
+            self.cast(n, [[n % 2 + 1]])
+        shards = TallyShard.all_shards(self.contest)
+        TallyShard.clear(self.contest)
+        self.assertEqual([], TallyShard.all_shards(self.contest))
+        for shard in shards:
+            self.assertEqual(0, BallotBucket.all().ancestor(shard.key()).count())
@@ -1,6 +1,8 @@
+from collections import defaultdict
 from datetime import datetime, timedelta
 from itertools import count, izip
-from voting.models import Candidate, Election, Vote
+from voting.methods import methods
+from voting.models import BallotBucket, Candidate, Election, PairwiseTally, TallyShard, Vote, format_ranks
 from pages import application, db
 from tests import VotingTestCase
 from webtest import TestApp
@@ -27,6 +29,18 @@ class RootTestCase(VotingTestCase):
         print response
         self.assertIn("/create", response)
     
+    def test_create_seats(self):
+        self.login()
+        app = TestApp(application)
+        app.post("/create", {"slug": "abcd", "title": "Committee", "seats": "3"})
+        self.assertEqual(3, Election.get_by_key_name("abcd").seats)
+    
+    def test_create_seats_invalid(self):
+        self.login()
+        app = TestApp(application)
+        app.post("/create", {"slug": "abcd", "title": "Committee", "seats": "-2"})
+        self.assertEqual(1, Election.get_by_key_name("abcd").seats)
+    
     def test_public_listed(self):
         # Approved, currently-open elections should be listed on the front page.
         self.check_shown(shown=True, public=True, approved=True, closes=+1)
@@ -113,26 +127,143 @@ class VotePageTestCase(VotingTestCase):
     def test_vote_ranked(self):
         expected = str.join(";", self.candidates)
         vote = self.vote(dict(izip(self.candidates, count(2))))
-        self.assertEquals(vote.ranks, expected)
+        self.assertEquals(format_ranks(vote.rankings()), expected)
     
     def test_voting_equal(self):
         expected = str.join(",", self.candidates)
         vote = self.vote(dict.fromkeys(self.candidates, 2))
-        self.assertEquals(vote.ranks, expected)
+        self.assertEquals(format_ranks(vote.rankings()), expected)
     
     def test_voting_mixed(self):
         first, second, third = self.candidates
         expected = second+","+third+";"+first
         vote = self.vote({first: 4, second: 2, third: 2})
-        self.assertEquals(vote.ranks, expected)
+        self.assertEquals(format_ranks(vote.rankings()), expected)
     
     def test_voting_with_unranked(self):
         first, second, third = self.candidates
         expected = second+";"+third
         vote = self.vote({first: 0, second: 2, third: 4})
-        self.assertEquals(vote.ranks, expected)
+        self.assertEquals(format_ranks(vote.rankings()), expected)
+    
+    def test_vote_lists(self):
+        first, second, third = self.candidates
+        vote = self.vote({first: 2, second: 4, third: 4})
+        self.assertEquals([int(first), int(second), int(third)], vote.choices)
+        self.assertEquals([1, 2], vote.groups)
+        self.assertIsNone(vote.ranks)
+    
+    def test_vote_text_replaced(self):
+        # Votes stored in the older schema still count, and are
+        # rewritten into the list properties when changed.
+        first, second, third = self.candidates
+        key = self.contest.key().name()+"/"+str(self.user.user_id())
+        Vote(key_name=key, election=self.contest, voter=self.user, ranks=first+";"+second).put()
+        PairwiseTally.rebuild(self.contest)
+        
+        self.page = self.app.get("/"+self.contest.key().name()+"/vote")
+        vote = self.vote({first: 4, second: 2, third: 0})
+        self.assertEquals([[int(second)], [int(first)]], vote.rankings())
+        self.assertIsNone(vote.ranks)
+        tally = PairwiseTally.current(self.contest)
+        self.assertEqual(1, tally.ballots)
+        self.assertEqual(0, tally.matrix()[int(first), int(second)])
+        self.assertEqual(1, tally.matrix()[int(second), int(first)])
     
     def test_voting_all_unranked(self):
         vote = self.vote(dict.fromkeys(self.candidates, 0))
         self.assertIsNone(vote)
-
+    
+    def test_tally_updated(self):
+        PairwiseTally.create(self.contest)
+        first, second, third = self.candidates
+        self.vote({first: 2, second: 4, third: 0})
+        matrix = PairwiseTally.current(self.contest).matrix()
+        self.assertEqual(1, matrix[int(first), int(second)])
+        self.assertEqual(0, matrix[int(second), int(first)])
+        
+        self.page = self.app.get("/"+self.contest.key().name()+"/vote")
+        self.vote({first: 4, second: 2, third: 0})
+        tally = PairwiseTally.current(self.contest)
+        self.assertEqual(1, tally.ballots)
+        self.assertEqual(0, tally.matrix()[int(first), int(second)])
+        self.assertEqual(1, tally.matrix()[int(second), int(first)])
+    
+    def test_tally_rebuilt(self):
+        first, second, third = self.candidates
+        self.vote({first: 2, second: 4, third: 6})
+        self.assertIsNone(PairwiseTally.get_by_key_name(self.contest.key().name()))
+        response = self.app.get("/"+self.contest.key().name()+"/results/rankedpairs")
+        self.assertIn("Favorite", response)
+        tally = PairwiseTally.get_by_key_name(self.contest.key().name())
+        self.assertEqual(1, tally.matrix()[int(first), int(third)])
+    
+    def test_results_top(self):
+        first, second, third = self.candidates
+        self.vote({first: 2, second: 4, third: 6})
+        response = self.app.get("/"+self.contest.key().name()+"/results/rankedpairs?top=1")
+        self.assertIn("Favorite", response)
+        self.assertNotIn("Underdog", response)
+    
+    def test_results_negative_top(self):
+        first, second, third = self.candidates
+        self.vote({first: 2, second: 4, third: 6})
+        for top in ("0", "-1"):
+            response = self.app.get("/"+self.contest.key().name()+"/results/rankedpairs?top="+top)
+            self.assertIn("Favorite", response)
+            self.assertIn("Underdog", response)
+    
+    def test_results_seats(self):
+        # The election's seat count reaches the methods that take one.
+        calls = []
+        def stv(votes, candidates, top=None, seats=1):
+            calls.append(seats)
+            return []
+        stv.pairwise = False
+        stv.scores = None
+        stv.multiwinner = True
+        
+        name = "Single Transferable Vote"
+        original = methods[name]
+        methods[name] = stv
+        try:
+            self.contest.seats = 2
+            self.contest.put()
+            self.app.get("/"+self.contest.key().name()+"/results/stv")
+        finally:
+            methods[name] = original
+        self.assertEqual([2], calls)
+    
+    def test_minimax_scores(self):
+        first, second, third = self.candidates
+        self.vote({first: 2, second: 4, third: 6})
+        response = self.app.get("/"+self.contest.key().name()+"/results/minimax")
+        self.assertIn("undefeated", response)
+        self.assertIn("worst defeat 1 to 0", response)
+    
+    def shard_buckets(self):
+        # Shards may hold negative counts for a voter's earlier ballot.
+        buckets = defaultdict(int)
+        for shard in TallyShard.all_shards(self.contest):
+            for bucket in BallotBucket.all().ancestor(shard):
+                buckets[bucket.ranks] += bucket.count
+        return dict((ranks, buckets[ranks]) for ranks in buckets if buckets[ranks])
+    
+    def test_buckets_moved(self):
+        PairwiseTally.create(self.contest)
+        first, second, third = self.candidates
+        self.vote({first: 2, second: 4, third: 4})
+        self.assertEqual({first+";"+second+","+third: 1}, self.shard_buckets())
+        
+        self.page = self.app.get("/"+self.contest.key().name()+"/vote")
+        self.vote({first: 4, second: 2, third: 0})
+        self.assertEqual({second+";"+first: 1}, self.shard_buckets())
+    
+    def test_buckets_tabulated(self):
+        first, second, third = self.candidates
+        self.vote({first: 2, second: 4, third: 6})
+        response = self.app.get("/"+self.contest.key().name()+"/results/plurality")
+        self.assertIn("Favorite", response)
+        tally = PairwiseTally.get_by_key_name(self.contest.key().name())
+        buckets = [(b.ranks, b.count) for b in BallotBucket.all().ancestor(tally)]
+        self.assertEqual([(str.join(";", self.candidates), 1)], buckets)
@@ -0,0 +1,34 @@
+from tests import VotingTestCase
+from tests import test_voting
+from voting.methods import methods
+from voting.parallel import deserialize, evaluate, serialize
+
+class EvaluateTestCase(VotingTestCase):
+    candidates = test_voting.TenesseeTestCase.candidates
+    ballots = test_voting.TenesseeTestCase.ballots
+    
+    def check_results(self, results):
+        expected = dict((method.__name__, test_voting.TenesseeTestCase.results[method])
+            for method in test_voting.TenesseeTestCase.results)
+        self.assertEqual(set(methods), set(results))
+        for name in results:
+            evaluation = results[name]
+            self.assertEqual(None, evaluation.error)
+            self.assertTrue(evaluation.seconds >= 0)
+            result = map(test_voting.maybe_tuple, evaluation.ranks)
+            self.assertEqual(expected[methods[name].__name__], result)
+    
+    def test_parallel(self):
+        self.check_results(evaluate(self.ballots, self.candidates, processes=2))
+    
+    def test_serial(self):
+        self.check_results(evaluate(self.ballots, self.candidates, processes=0))
+    
+    def test_names(self):
+        results = evaluate(self.ballots, self.candidates, names=["Plurality"], processes=0)
+        self.assertEqual(["Plurality"], list(results))
+    
+    def test_serialize(self):
+        tally = deserialize(serialize(self.ballots, self.candidates))
+        self.assertEqual(range(4), tally.candidates)
+        self.assertEqual(100, tally.total())
@@ -0,0 +1,78 @@
+from tests import VotingTestCase
+from tests import test_voting
+from voting import stats
+from voting.methods import Tally, methods
+
+class CollectorTestCase(VotingTestCase):
+    candidates = test_voting.TenesseeTestCase.candidates
+    ballots = test_voting.TenesseeTestCase.ballots
+    
+    def setUp(self):
+        super(CollectorTestCase, self).setUp()
+        self.collector = stats.Collector()
+        self.previous = stats.collect(self.collector)
+    
+    def tearDown(self):
+        stats.collect(self.previous)
+        super(CollectorTestCase, self).tearDown()
+    
+    def run_method(self, name, top=None):
+        return list(methods[name](Tally(self.ballots, self.candidates), self.candidates, top=top))
+    
+    def test_disabled(self):
+        stats.collect(None)
+        self.run_method("Ranked Pairs")
+        self.assertFalse(self.collector)
+    
+    def test_ballots(self):
+        self.run_method("Plurality")
+        self.assertEqual(len(self.ballots), self.collector.counts["ballots.distinct"])
+        self.assertIn("ballots", self.collector.timings)
+    
+    def test_pairwise(self):
+        self.run_method("Ranked Pairs")
+        self.assertIn("pairwise", self.collector.timings)
+        self.assertIn("rankedpairs.lock", self.collector.timings)
+    
+    def test_edges(self):
+        # Four candidates with a Condorcet ordering: every edge locks.
+        self.run_method("Ranked Pairs")
+        self.assertEqual(6, self.collector.counts["rankedpairs.locked"])
+        self.assertEqual(0, self.collector.counts["rankedpairs.pruned"])
+    
+    def test_rounds(self):
+        self.run_method("Instant-Runoff")
+        self.assertEqual(4, self.collector.counts["instantrunoff.rounds"])
+    
+    def test_rounds_limited(self):
+        # The winner needs only the rounds before the first majority.
+        self.run_method("Instant-Runoff", top=1)
+        self.assertEqual(3, self.collector.counts["instantrunoff.rounds"])
+    
+    def test_trie(self):
+        self.run_method("Single Transferable Vote")
+        self.assertIn("trie", self.collector.timings)
+        self.assertEqual(3, self.collector.counts["stv.rounds"])
+    
+    def test_minimax_limited(self):
+        self.run_method("Minimax", top=2)
+        self.assertEqual(2, self.collector.counts["minimax.rounds"])
+    
+    def test_paths(self):
+        self.run_method("Beatpath")
+        self.assertTrue(self.collector.counts["paths.explored"] > 0)
+    
+    def test_accumulated(self):
+        self.run_method("Minimax")
+        self.run_method("Minimax")
+        self.assertEqual(8, self.collector.counts["minimax.rounds"])
+    
+    def test_report(self):
+        self.collector.count("rounds", 3)
+        self.collector.timing("ballots", 0.0125)
+        self.assertEqual("ballots: 12.50 ms\nrounds: 3", self.collector.report())
+    
+    def test_phase(self):
+        done = stats.phase("example")
+        done()
+        self.assertTrue(self.collector.timings["example"] >= 0)
@@ -1,5 +1,7 @@
 from tests import VotingTestCase
 from voting.methods import *
+from voting.methods import (BallotTrie, BitGraph, Graph, PairwiseMatrix, Tally,
+    beatpath_paths, compress, kemeny_permutations, methods, minimax_scores, numpy, pairwise)
 
 def maybe_tuple(items):
     result = tuple(sorted(items))
@@ -7,6 +9,27 @@ def maybe_tuple(items):
         result = result[0]
     return result
 
+def random_ballots(rng, candidates, count, partial=False):
+    r'''Draws `count` random ballots from `rng`, each with a random count.
+        Each ballot ranks at least one candidate, one per rank, unless
+        `partial` allows empty ballots, shared ranks, and a candidate
+        missing from `candidates`.
+    '''#"""#'''
+    ballots = []
+    for n in range(count):
+        keys = list(candidates)
+        if partial:
+            keys.append("Z")
+        rng.shuffle(keys)
+        keys = keys[:rng.randint(int(not partial), len(keys))]
+        rows = []
+        while keys:
+            size = partial and rng.choice([1, 1, 2, 3]) or 1
+            rows.append(tuple(keys[:size]))
+            keys = keys[size:]
+        ballots.append((rows, rng.randint(1, 5)))
+    return ballots
+
 class MethodTestCase(VotingTestCase):
     r'''Base class for testing the voting methods.
         Each TestCase class presents a single election.
@@ -39,11 +62,20 @@ class MethodTestCase(VotingTestCase):
         borda: [0, 1, 2, 3],
         minimax: [0, 1, 2, 3],
         kemeny: [0, 1, 2, 3],
+        stv: [0, 1, 2, 3],
     }
     
     def check_method(self, method):
         result = map(maybe_tuple, method(self.ballots, self.candidates))
         self.assertEqual(self.results[method], result)
+        
+        # Limited runs agree with the start of the full ordering.
+        for top in (1, 2):
+            result = map(maybe_tuple, method(self.ballots, self.candidates, top=top))
+            self.assertEqual(self.results[method][:top], result)
+        
+        # Negative limits are refused, rather than sliced from the end.
+        self.assertRaises(ValueError, lambda: list(method(self.ballots, self.candidates, top=-1)))
     
     def test_rankedpairs(self):
         self.check_method(rankedpairs)
@@ -71,6 +103,34 @@ class MethodTestCase(VotingTestCase):
     
     def test_kemeny(self):
         self.check_method(kemeny)
+    
+    def test_stv(self):
+        self.check_method(stv)
+    
+    def check_converted(self, convert, pairwise=False):
+        ballots = convert(self.ballots, self.candidates)
+        for method in self.results:
+            if pairwise and not method.pairwise:
+                continue
+            result = map(maybe_tuple, method(ballots, self.candidates))
+            self.assertEqual(self.results[method], result, method.__name__)
+    
+    def test_compressed(self):
+        # Merging identical ballots must not change any result.
+        self.check_converted(compress)
+    
+    def test_tally(self):
+        # A single Tally should serve every method.
+        self.check_converted(Tally)
+    
+    def test_matrix(self):
+        # The pairwise methods should need nothing but the matrix,
+        # even when it was counted for other candidates.
+        def convert(ballots, candidates):
+            matrix = PairwiseMatrix(list(candidates) + ["Extra"])
+            matrix.update(ballots)
+            return Tally.from_matrix(matrix)
+        self.check_converted(convert, pairwise=True)
 
 class CriterionTestCase(MethodTestCase):
     r'''Base class for testing voting method criteria.
@@ -113,12 +173,22 @@ class CriterionTestCase(MethodTestCase):
         borda: True,
         minimax: True,
         kemeny: True,
+        stv: True,
     }
     
     def check_results(self, results):
         r'''Given a set of results, one per election, check the criterion.'''
         return results[0] == results[1]
     
+    def check_converted(self, convert, pairwise=False):
+        elections = [convert(election, self.candidates) for election in self.ballots]
+        for method in self.results:
+            if pairwise and not method.pairwise:
+                continue
+            result = self.check_results([list(method(election, self.candidates))
+                    for election in elections])
+            self.assertEqual(self.results[method], result, method.__name__)
+    
     def check_method(self, method):
         result = self.check_results([list(method(election, self.candidates))
                 for election in self.ballots])
@@ -162,6 +232,7 @@ class TenesseeTestCase(MethodTestCase):
         borda: ["Nashville", "Chattanooga", "Memphis", "Knoxville"],
         minimax: ["Nashville", "Chattanooga", "Knoxville", "Memphis"],
         kemeny: ["Nashville", "Chattanooga", "Knoxville", "Memphis"],
+        stv: ["Knoxville", "Memphis", "Nashville", "Chattanooga"],
     }
 
 class MajorityTestCase(MethodTestCase):
@@ -194,6 +265,7 @@ class MajorityTestCase(MethodTestCase):
         borda: ["Catherine", "Andrew", "Brian", "David"],
         minimax: ["Andrew", "Catherine", "Brian", "David"],
         kemeny: ["Andrew", "Catherine", "Brian", "David"],
+        stv: ["Andrew", "Brian", "David", "Catherine"],
     }
 
 class EqualRanksTestCase(MethodTestCase):
@@ -219,6 +291,7 @@ class EqualRanksTestCase(MethodTestCase):
         borda: [2, 1, 0, 3],
         minimax: [(0, 1), 2, 3],
         kemeny: [(0, 1), 2, 3],
+        stv: [(0, 1), 2, 3],
     }
 
 class MonotonicityTestCase(CriterionTestCase):
@@ -258,6 +331,7 @@ class MonotonicityTestCase(CriterionTestCase):
         borda: True,
         minimax: True,
         kemeny: True,
+        stv: False,
     }
     
     def check_results(self, results):
@@ -315,6 +389,7 @@ class ReversalTestCase(CriterionTestCase):
         borda: True,
         minimax: False,
         kemeny: False,
+        stv: False,
     }
     
     def check_results(self, results):
@@ -344,8 +419,6 @@ class PluralityTestCase(MethodTestCase):
         ([8, (1, 2, 3, 4, 5, 6, 7), 0], 7),
     ]
     
-    # Kemeny-Young should have the commented-out result,
-    # but returns a full tie to avoid the massive computation.
     results = {
         rankedpairs: [1, 2, (3, 4, 5, 6), 7, 8, 0],
         beatpath: [1, 2, (3, 4, 5, 6), 7, 8, 0],
@@ -355,8 +428,8 @@ class PluralityTestCase(MethodTestCase):
         bucklin: [1, 2, (3, 4, 5, 6), 7, 8, 0],
         borda: [1, 2, (3, 4, 5, 6), 7, 8, 0],
         minimax: [1, 2, (3, 4, 5, 6), 7, 8, 0],
-        #kemeny: [1, 2, (3, 4, 5, 6), 7, 8, 0],
-        kemeny: [(0, 1, 2, 3, 4, 5, 6, 7, 8)],
+        kemeny: [1, 2, (3, 4, 5, 6), 7, 8, 0],
+        stv: [1, 2, 0, (3, 4, 5, 6), 7, 8],
     }
 
 class TeamingTestCase(MethodTestCase):
@@ -390,6 +463,7 @@ class TeamingTestCase(MethodTestCase):
         borda: ["B", "C", "A", "E", "D"],
         minimax: ["A", "B", "C", "D", "E"],
         kemeny: ["B", "C", "D", "A", "E"],
+        stv: ["A", "B", "E", "C", "D"],
     }
 
 class RunoffTestCase(MethodTestCase):
@@ -420,6 +494,7 @@ class RunoffTestCase(MethodTestCase):
         borda: ["Left", "Right", "Far Left", "Far Right"],
         minimax: ["Left", "Far Left", "Right", "Far Right"],
         kemeny: ["Left", "Far Left", "Right", "Far Right"],
+        stv: ["Left", "Right", "Far Left", "Far Right"],
     }
 
 class CondorcetTestCase(MethodTestCase):
@@ -451,6 +526,7 @@ class CondorcetTestCase(MethodTestCase):
         borda: ["Center", "Right", "Left"],
         minimax: ["Center", "Right", "Left"],
         kemeny: ["Center", "Right", "Left"],
+        stv: ["Right", "Left", "Center"],
     }
 
 class MinimaxTestCase(MethodTestCase):
@@ -480,6 +556,7 @@ class MinimaxTestCase(MethodTestCase):
         borda: ["Gore", "Nader", "Bush"],
         minimax: ["Gore", "Bush", "Nader"],
         kemeny: ["Nader", "Gore", "Bush"],
+        stv: ["Bush", "Nader", "Gore"],
     }
 
 class SmithSetTestCase(MethodTestCase):
@@ -513,6 +590,7 @@ class SmithSetTestCase(MethodTestCase):
         borda: ["A", "C", "B", "D"],
         minimax: ["D", "A", "B", "C"],
         kemeny: ["A", "B", "C", "D"],
+        stv: ["A", "D", "B", "C"],
     }
 
 class ClonesTestCase(MethodTestCase):
@@ -544,6 +622,7 @@ class ClonesTestCase(MethodTestCase):
         borda: [("R", "S"), "A", "T"],
         minimax: ["A", "R", "S", "T"],
         kemeny: [("A", "R", "S", "T")],
+        stv: ["A", ("R", "S"), "T"],
     }
 
 class BeatpathTestCase(MethodTestCase):
@@ -578,6 +657,7 @@ class BeatpathTestCase(MethodTestCase):
         borda: ["A", "B", "C", "D"],
         minimax: ["A", "B", "C", "D"],
         kemeny: ["B", "A", "C", "D"],
+        stv: ["B", "C", "D", "A"],
     }
 
 class PentagonTestCase(MethodTestCase):
@@ -619,6 +699,7 @@ class PentagonTestCase(MethodTestCase):
         borda: [("A", "B"), "D", "E", "C"],
         minimax: ["A", "B", ("D", "E"), "C"],
         kemeny: ["A", "B", "D", "C", "E"],
+        stv: ["B", "E", "D", "C", "A"],
     }
 
 class WholeRunoffTestCase(MethodTestCase):
@@ -652,6 +733,7 @@ class WholeRunoffTestCase(MethodTestCase):
         borda: ["B", "A", "C"],
         minimax: ["B", "A", "C"],
         kemeny: ["B", "A", "C"],
+        stv: ["A", "C", "B"],
     }
 
 class FractionalRunoffTestCase(MethodTestCase):
@@ -680,6 +762,7 @@ class FractionalRunoffTestCase(MethodTestCase):
         borda: ["A", "B", "C", "D"],
         minimax: ["A", "B", "C", "D"],
         kemeny: ["A", "B", "C", "D"],
+        stv: ["A", "C", "B", "D"],
     }
 
 class IncompleteTestCase(MethodTestCase):
@@ -706,6 +789,7 @@ class IncompleteTestCase(MethodTestCase):
         borda: ["A", "B", "D", "C", "E"],
         minimax: ["A", "B", "C", "D", "E"],
         kemeny: ["A", "B", "C", "D", "E"],
+        stv: ["B", "A", "C", ("D", "E")],
     }
 
 class RiverTestCase(MethodTestCase):
@@ -747,6 +831,7 @@ class RiverTestCase(MethodTestCase):
         borda: ["C", "B", "A", "D"],
         minimax: ["B", "C", "D", "A"],
         kemeny: ["A", "B", "C", "D"],
+        stv: ["A", "B", "C", "D"],
     }
 
 class PairwiseTestCase(MethodTestCase):
@@ -783,6 +868,7 @@ class PairwiseTestCase(MethodTestCase):
         borda: ["Abby", "Brad", "Cora", "Dave", "Erin"],
         minimax: ["Cora", "Abby", "Brad", "Erin", "Dave"],
         kemeny: ["Brad", "Abby", "Erin", "Dave", "Cora"],
+        stv: ["Dave", "Brad", "Cora", "Abby", "Erin"],
     }
 
 class TiedTestCase(MethodTestCase):
@@ -810,6 +896,7 @@ class TiedTestCase(MethodTestCase):
         borda: [("Ryan", "Sara"), "Todd"],
         minimax: [("Ryan", "Sara"), "Todd"],
         kemeny: [("Ryan", "Sara"), "Todd"],
+        stv: [("Ryan", "Sara"), "Todd"],
     }
 
 class RoShamBoTestCase(MethodTestCase):
@@ -835,6 +922,7 @@ class RoShamBoTestCase(MethodTestCase):
         borda: [("Paper", "Rock", "Scissors")],
         minimax: [("Paper", "Rock", "Scissors")],
         kemeny: [("Paper", "Rock", "Scissors")],
+        stv: [("Paper", "Rock", "Scissors")],
     }
 
 class OctahedronTestCase(MethodTestCase):
@@ -864,6 +952,7 @@ class OctahedronTestCase(MethodTestCase):
         borda: ["A", ("B", "C", "D", "E"), "F"],
         minimax: ["A", ("B", "C", "D", "E"), "F"],
         kemeny: ["A", ("B", "C", "D", "E"), "F"],
+        stv: ["A", ("B", "C", "D", "E"), "F"],
     }
 
 class EqualWeightTestCase(MethodTestCase):
@@ -896,6 +985,7 @@ class EqualWeightTestCase(MethodTestCase):
         borda: ["A", ("B", "C", "D"), "E"],
         minimax: ["A", ("B", "C", "D", "E")],
         kemeny: ["A", ("B", "C", "D"), "E"],
+        stv: ["A", ("B", "C", "D"), "E"],
     }
 
 class DeletedCandidateTestCase(MethodTestCase):
@@ -922,6 +1012,7 @@ class DeletedCandidateTestCase(MethodTestCase):
         borda: ["A", "B", "C"],
         minimax: ["A", "B", "C"],
         kemeny: ["A", "B", "C"],
+        stv: ["A", "C", "B"],
     }
 
 class NewCandidateTestCase(MethodTestCase):
@@ -949,5 +1040,327 @@ class NewCandidateTestCase(MethodTestCase):
         borda: ["A", "B", "E", "C", "D"],
         minimax: [("A", "E"), "B", "C", "D"],
         kemeny: [("A", "B", "C", "D", "E")],
+        stv: ["A", "B", "C", "D", "E"],
     }
 
+
+class STVTestCase(VotingTestCase):
+    r'''Multi-winner elections for the Single Transferable Vote.
+        From the example on http://en.wikipedia.org/wiki/Single_transferable_vote
+    '''#"""#'''
+    
+    candidates = ["Oranges", "Pears", "Chocolate", "Strawberries", "Sweets"]
+    
+    ballots = [
+        (["Oranges"], 4),
+        (["Pears", "Oranges"], 2),
+        (["Chocolate", "Strawberries"], 8),
+        (["Chocolate", "Sweets"], 4),
+        (["Strawberries"], 1),
+        (["Sweets"], 1),
+    ]
+    
+    def test_seats(self):
+        result = map(maybe_tuple, stv(self.ballots, self.candidates, seats=3))
+        self.assertEqual(["Chocolate", "Oranges", "Strawberries", "Sweets", "Pears"], result)
+    
+    def test_top(self):
+        result = map(maybe_tuple, stv(self.ballots, self.candidates, top=2, seats=3))
+        self.assertEqual(["Chocolate", "Oranges"], result)
+    
+    def test_fractional(self):
+        # Chocolate passes on 1/12 of each ballot, leaving Pears with 2,
+        # Strawberries with 5/3 votes, and Sweets with 4/3.
+        result = map(maybe_tuple, stv(self.ballots, self.candidates, seats=1))
+        self.assertEqual(["Chocolate", "Oranges", "Pears", "Strawberries", "Sweets"], result)
+    
+    def test_equal_ranks(self):
+        # A surplus passes on to the others in a shared rank, so that
+        # B gets 3/5 of a vote from A, and ends up ahead of C.
+        ballots = [
+            (["A", "C"], 8),
+            ([("A", "B"), "C"], 4),
+            (["B"], 2),
+            (["C"], 1),
+            (["D"], 3),
+        ]
+        result = map(maybe_tuple, stv(ballots, "ABCD", seats=2))
+        self.assertEqual(["A", "B", "C", "D"], result)
+    
+    def test_all_seated(self):
+        result = map(maybe_tuple, stv(self.ballots, self.candidates, seats=5))
+        self.assertEqual(["Chocolate", "Oranges", "Strawberries", "Sweets", "Pears"], result)
+    
+    def test_multiwinner(self):
+        # Only STV takes the election's seat count.
+        self.assertEqual([stv], [method for method in methods.itervalues() if method.multiwinner])
+    
+    def test_many_seats(self):
+        # Exact fractions grow with every transfer; this took minutes.
+        from random import Random
+        ballots = random_ballots(Random(1), range(30), 3000)
+        result = stv(ballots, range(30), seats=25)
+        self.assertEqual(range(30), sorted(key for rank in result for key in rank))
+
+class BallotTrieTestCase(VotingTestCase):
+    def test_shared(self):
+        trie = BallotTrie()
+        trie.add([(0,), (1, 2)], 3)
+        trie.add([(0,), (3,)], 2)
+        trie.add([], 1)
+        self.assertEqual(6, trie.count)
+        self.assertEqual(4, trie.size())
+        first = trie.children[(0,)]
+        self.assertEqual(5, first.count)
+        self.assertEqual(3, first.children[(1, 2)].count)
+        self.assertEqual({}, first.children[(3,)].children)
+    
+    def test_tally(self):
+        tally = Tally([("ABC", 2), ("ABD", 1), ("BA", 4)], "ABCD")
+        trie = tally.trie()
+        self.assertEqual(7, trie.count)
+        self.assertEqual(3, trie.children[(0,)].children[(1,)].count)
+
+class PairwiseMatrixTestCase(VotingTestCase):
+    r'''The dense pairwise matrix should count each ranked pair exactly once.
+        Unranked candidates and equal rankings contribute nothing.
+    '''#"""#'''
+    
+    candidates = "ABCD"
+    
+    ballots = [
+        ("ABC", 3),
+        (["B", ("A", "C")], 2),
+        ("DXA", 1),
+    ]
+    
+    def test_counts(self):
+        matrix = PairwiseMatrix(self.candidates)
+        matrix.update(self.ballots)
+        expected = {
+            ("A", "B"): 3, ("A", "C"): 3, ("B", "C"): 5,
+            ("B", "A"): 2, ("C", "B"): 0, ("C", "A"): 0,
+            ("D", "A"): 1, ("A", "D"): 0, ("B", "D"): 0,
+        }
+        for pair in expected:
+            self.assertEqual(expected[pair], matrix[pair])
+    
+    def test_removal(self):
+        matrix = PairwiseMatrix(self.candidates)
+        matrix.update(self.ballots)
+        matrix.add("ABC", -3)
+        self.assertEqual(0, matrix["A", "C"])
+        self.assertEqual(2, matrix["B", "C"])
+    
+    def test_majorities(self):
+        expected = {
+            ("A", "B"): (3, 2),
+            ("A", "C"): (3, 0),
+            ("B", "C"): (5, 0),
+            ("D", "A"): (1, 0),
+        }
+        self.assertEqual(expected, pairwise(self.ballots, self.candidates))
+
+class CompressTestCase(VotingTestCase):
+    r'''Ballot compression should merge rankings that count identically.
+    '''#"""#'''
+    
+    def test_merged(self):
+        ballots = [
+            (["A", ("C", "B")], 2),
+            (["A", ("B", "C", "X")], 3),
+            (["X", "A", "B", "C"], 1),
+            (["X"], 4),
+            ([], 1),
+        ]
+        expected = [
+            ((), 5),
+            ((("A",), ("B", "C")), 5),
+            ((("A",), ("B",), ("C",)), 1),
+        ]
+        self.assertEqual(sorted(expected), sorted(compress(ballots, "ABC")))
+    
+    def test_repeated(self):
+        ballots = [(["A", ("A", "B"), "C", "B"], 1)]
+        expected = [((("A",), ("B",), ("C",)), 1)]
+        self.assertEqual(expected, compress(ballots, "ABC"))
+
+class KemenyTestCase(VotingTestCase):
+    r'''The subset tables should find the same orderings as brute force.
+    '''#"""#'''
+    
+    def test_reference(self):
+        from random import Random
+        rng = Random(3)
+        for trial in range(40):
+            candidates = "ABCDEF"[:rng.randint(2, 6)]
+            ballots = random_ballots(rng, candidates, rng.randint(1, 8))
+            expected = map(maybe_tuple, kemeny_permutations(ballots, candidates))
+            result = map(maybe_tuple, kemeny(ballots, candidates))
+            self.assertEqual(expected, result, ballots)
+    
+    def test_large(self):
+        # Larger elections should be solved, not collapsed into a tie.
+        candidates = range(16)
+        ballots = [(candidates, 3), (candidates[::-1], 2)]
+        result = map(maybe_tuple, kemeny(ballots, candidates))
+        self.assertEqual(candidates, result)
+
+class BeatpathReferenceTestCase(VotingTestCase):
+    r'''The widest path computation should match full path enumeration.
+    '''#"""#'''
+    
+    def test_reference(self):
+        from random import Random
+        rng = Random(4)
+        for trial in range(40):
+            candidates = "ABCDEFG"[:rng.randint(2, 7)]
+            ballots = random_ballots(rng, candidates, rng.randint(1, 12))
+            expected = map(maybe_tuple, beatpath_paths(ballots, candidates))
+            result = map(maybe_tuple, beatpath(ballots, candidates))
+            self.assertEqual(expected, result, ballots)
+
+class BitGraphTestCase(VotingTestCase):
+    r'''The bitmask graph should behave exactly like the set-based one.
+    '''#"""#'''
+    
+    def graphs(self, vertices):
+        return Graph(vertices), BitGraph(vertices)
+    
+    def test_cycles(self):
+        for graph in self.graphs("ABCD"):
+            self.assertEqual(2, graph.acyclic_edges([("A", "B"), ("B", "C")]))
+            self.assertEqual(1, graph.acyclic_edges([("C", "A"), ("C", "D")]))
+            self.assertEqual(set([("A", "B"), ("B", "C"), ("C", "D")]), set(graph.edges()))
+    
+    def test_layers(self):
+        for graph in self.graphs("ABCDE"):
+            graph.acyclic_edges([("A", "B"), ("A", "C"), ("B", "D"), ("C", "D")])
+            self.assertEqual(set("AE"), set(graph.roots()))
+            layers = []
+            while graph:
+                layers.append(graph.pop())
+            self.assertEqual([set("AE"), set("BC"), set("D")], layers)
+    
+    def test_reaches(self):
+        graph = BitGraph("ABCD")
+        graph.acyclic_edges([("A", "B"), ("B", "C")])
+        self.assertTrue(graph.reaches("A", "C"))
+        self.assertFalse(graph.reaches("C", "A"))
+        graph.remove_edge("A", "B")
+        self.assertFalse(graph.reaches("A", "C"))
+    
+    def test_random(self):
+        from random import Random
+        rng = Random(7)
+        vertices = range(8)
+        for trial in range(50):
+            # Like the voting methods, offer each ordered pair only once.
+            offers = [(a, b) for a in vertices for b in vertices if a != b]
+            rng.shuffle(offers)
+            old, new = self.graphs(vertices)
+            for step in range(6):
+                edges = [offers.pop() for n in range(rng.randint(1, 4))]
+                if rng.random() < 0.5:
+                    self.assertEqual(old.acyclic_edges(edges), new.acyclic_edges(edges))
+                else:
+                    self.assertEqual(old.river_edges(edges), new.river_edges(edges))
+                self.assertEqual(set(old.edges()), set(new.edges()))
+            while old:
+                self.assertEqual(old.pop(), new.pop())
+            self.assertFalse(new)
+
+class MinimaxScoresTestCase(VotingTestCase):
+    r'''Minimax scores are the strongest defeat suffered by each candidate.
+    '''#"""#'''
+    
+    def test_scores(self):
+        expected = {
+            "Bush": (55, 45),
+            "Gore": (29, 26),
+            "Nader": (45, 43),
+        }
+        self.assertEqual(expected, minimax_scores(MinimaxTestCase.ballots, MinimaxTestCase.candidates))
+    
+    def test_unbeaten(self):
+        expected = {"A": 0, "B": (10, 0), "C": (10, 0)}
+        self.assertEqual(expected, minimax_scores([("AB", 10), ("AC", 10)], "ABC"))
+    
+    def test_registered(self):
+        # Results pages find the scores through the registry.
+        self.assertTrue(minimax.scores is minimax_scores)
+        self.assertEqual(None, borda.scores)
+
+class TallyTestCase(VotingTestCase):
+    r'''A Tally should read its ballots once, and only when needed.
+    '''#"""#'''
+    
+    def test_single_pass(self):
+        reads = []
+        def ballots():
+            reads.append(True)
+            for ballot in TenesseeTestCase.ballots:
+                yield ballot
+        
+        tally = Tally(ballots(), TenesseeTestCase.candidates)
+        self.assertEqual([], reads)
+        for method in methods.values():
+            list(method(tally, TenesseeTestCase.candidates))
+        self.assertEqual([True], reads)
+    
+    def test_other_candidates(self):
+        tally = Tally(TenesseeTestCase.ballots, TenesseeTestCase.candidates)
+        result = map(maybe_tuple, plurality(tally, ["Nashville", "Knoxville"]))
+        self.assertEqual(["Nashville", "Knoxville"], result)
+    
+    def test_indexed(self):
+        # Unknown and repeated candidates are dropped along the way.
+        tally = Tally([([("B", "Z"), "A", "B"], 2), (["C"], 1), ([("A", "B")], 3)], "ABC")
+        self.assertEqual([(((1,), (0,)), 2), (((2,),), 1), (((0, 1),), 3)], tally.indexed())
+    
+    def random_tally(self, seed):
+        from random import Random
+        rng = Random(seed)
+        candidates = list("ABCDEFG"[:rng.randint(1, 7)])
+        ballots = random_ballots(rng, candidates, rng.randint(0, 12), partial=True)
+        return Tally(ballots, candidates)
+    
+    def test_vector_borda(self):
+        # The NumPy summaries must match the loops exactly,
+        # including for tied, truncated, and empty ballots.
+        if numpy is None:
+            self.skipTest("NumPy is not available")
+        for seed in range(200):
+            tally = self.random_tally(seed)
+            self.assertEqual(tally._scalar_borda(), tally._vector_borda())
+    
+    def test_vector_first(self):
+        if numpy is None:
+            self.skipTest("NumPy is not available")
+        for seed in range(200):
+            tally = self.random_tally(seed)
+            self.assertEqual(tally._scalar_first(), tally._vector_first())
+    
+    def test_vector_first_large(self):
+        # The common multiple of many tie sizes overflows 64 bits,
+        # and would turn the totals negative.
+        if numpy is None:
+            self.skipTest("NumPy is not available")
+        candidates = range(1, 41)
+        ballots = [([n], 4000 + n) for n in candidates]
+        ballots += [([tuple(range(1, size + 1))], 1) for size in range(5, 38)]
+        tally = Tally(ballots, candidates)
+        self.assertEqual(tally._scalar_first(), tally._vector_first())
+        self.assertEqual([40], list(plurality(tally, candidates)[0]))
+    
+    def test_levels_shared(self):
+        if numpy is None:
+            self.skipTest("NumPy is not available")
+        tally = Tally(TenesseeTestCase.ballots, TenesseeTestCase.candidates)
+        levels, weights = tally.levels()
+        self.assertEqual((4, 4), levels.shape)
+        self.assertEqual([0, 1, 2, 3], levels[0].tolist())
+        self.assertEqual([42, 26, 15, 17], weights.tolist())
+        tally.borda()
+        tally.matrix()
+        self.assertTrue(tally.levels() is tally.levels())
@@ -0,0 +1,90 @@
+r'''Memcache layer for computed election results.
+    Results are keyed by election, method, and a per-election version
+    counter, which every change to the votes or candidates increments;
+    old results are simply never read again.
+'''#"""#'''
+
+from time import sleep, time
+from google.appengine.api import memcache
+
+# Seconds a computing request holds the recount lock.
+lock_time = 30
+# Seconds to wait for another request's recount before doing our own.
+patience = 2
+# Seconds between checks while waiting.
+interval = 0.1
+
+def _initial():
+    # Starting from the clock, instead of zero, keeps versions from
+    # repeating if the counter itself is evicted.
+    return int(time() * 1000)
+
+def version(slug):
+    r'''Collect the current vote version of an election.
+    '''#"""#'''
+    key = "version:" + slug
+    current = memcache.get(key)
+    if current is None:
+        current = _initial()
+        if not memcache.add(key, current):
+            # Another request initialized it first.
+            current = memcache.get(key) or current
+    return current
+
+def bump(slug):
+    r'''Invalidate every cached result for an election.
+        Called whenever a vote or candidate changes.
+    '''#"""#'''
+    memcache.incr("version:" + slug, initial_value=_initial())
+
+def results(slug, method, compute):
+    r'''Collect the results of a voting method, computing them if needed.
+        `compute` is called without arguments, and must return the ranks
+        as a sequence of candidate key sequences.
+        While one request recounts, others serve the previous version's
+        results if any, or wait briefly for the recount to finish,
+        so that a popular election doesn't trigger parallel recounts.
+        Returns a list of lists of candidate keys.
+    '''#"""#'''
+    return _cached("results", slug, method,
+        lambda: [list(rank) for rank in compute()])
+
+def scores(slug, method, compute):
+    r'''Collect the per-candidate scores behind a voting method's results,
+        computing them if needed, as results() does for the ranks.
+        `compute` is called without arguments, and must return a mapping
+        of candidate keys to scores.
+        Returns a dictionary of candidate keys to scores.
+    '''#"""#'''
+    return _cached("scores", slug, method, lambda: dict(compute()))
+
+def _cached(kind, slug, method, compute):
+    current = version(slug)
+    key = "%s:%s:%s:%s" % (kind, slug, method, current)
+    latest = "latest:%s:%s:%s" % (kind, slug, method)
+    found = memcache.get(key)
+    if found is not None:
+        return found
+    
+    lock = "lock:" + key
+    locked = memcache.add(lock, 1, time=lock_time)
+    if not locked:
+        # Someone else is already recounting.
+        stale = memcache.get(latest)
+        if stale is not None:
+            return stale[1]
+        
+        deadline = time() + patience
+        while time() < deadline:
+            sleep(interval)
+            found = memcache.get(key)
+            if found is not None:
+                return found
+    
+    try:
+        found = compute()
+        memcache.set_multi({key: found, latest: (current, found)})
+    finally:
+        if locked:
+            memcache.delete(lock)
+    return found
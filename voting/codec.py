@@ -0,0 +1,75 @@
+r'''Compact binary encoding for stored ballots.
+    A ranking of candidate ids, such as [[12, 15], [9]], is stored as a
+    marker byte followed by each id as an unsigned varint: seven bits per
+    byte, least significant first, with the high bit set on every byte
+    but the last.  A zero byte separates the ranks, which is unambiguous
+    because datastore ids start from one.
+    
+    Votes stored before this encoding use the text form "12,15;9";
+    read() accepts either.
+'''#"""#'''
+
+# Text ranks never start with this byte.
+marker = "\xb1"
+
+def encode(ranks):
+    r'''Encode a ranking, as a sequence of ranks of candidate ids.
+        Ids are sorted within each rank, and empty ranks are dropped,
+        so equivalent rankings encode identically.
+    '''#"""#'''
+    data = [marker]
+    for rank in ranks:
+        if not rank:
+            continue
+        if len(data) > 1:
+            data.append("\x00")
+        for key in sorted(rank):
+            key = int(key)
+            if key < 1:
+                raise ValueError("Candidate ids must be positive: %r" % key)
+            while key > 0x7f:
+                data.append(chr(key & 0x7f | 0x80))
+                key >>= 7
+            data.append(chr(key))
+    return "".join(data)
+
+def decode(data):
+    r'''Decode the output of encode() into lists of candidate ids.
+    '''#"""#'''
+    if data[:1] != marker:
+        raise ValueError("Not an encoded ballot: %r" % data)
+    ranks = []
+    rank = []
+    key = shift = 0
+    for char in data[1:]:
+        byte = ord(char)
+        if byte == 0 and not shift:
+            ranks.append(rank)
+            rank = []
+            continue
+        key |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            rank.append(key)
+            key = shift = 0
+    if shift:
+        raise ValueError("Truncated ballot: %r" % data)
+    if rank:
+        ranks.append(rank)
+    return ranks
+
+def parse(text):
+    r'''Split a text ranks string, such as "12,15;9",
+        into lists of candidate ids.
+    '''#"""#'''
+    if not text:
+        return []
+    return [map(int, rank.split(",")) for rank in text.split(";")]
+
+def read(value):
+    r'''Decode stored ranks in either the binary or the text format.
+    '''#"""#'''
+    if isinstance(value, str) and value[:1] == marker:
+        return decode(value)
+    return parse(value)
@@ -6,10 +6,23 @@ r'''Ranked voting methods.
             The second item is the number of times this sequence appears.
         `candidates` - A sequence of candidate keys.
             Keys in the vote rankings that don't appear in this list will be ignored.
+    Each also accepts an optional `top` limit, the number of ranks wanted;
+    the method stops once those are settled, and produces only those.
+    The default of None produces the full ordering.
 '''#"""#'''
 
 from __future__ import division
-from collections import defaultdict
+from array import array
+from collections import defaultdict, deque
+from itertools import islice
+
+from voting import stats
+
+try:
+    import numpy
+except ImportError:
+    # NumPy is optional; the pure-Python fallbacks produce identical results.
+    numpy = None
 
 try:
     from itertools import permutations
@@ -51,9 +64,21 @@ except NameError:
 __all__ = []
 methods = {}
 
-def method(name):
+def method(name, pairwise=False, scores=None, multiwinner=False):
+    r'''Registers a voting method under its display name.
+        `pairwise` marks methods that only need the pairwise matrix,
+        which can then be run from a Tally without ballots.
+        `scores` optionally names a function of (votes, candidates)
+        returning the per-candidate scores behind the ranking,
+        for results pages to show beside it.
+        `multiwinner` marks methods that take a `seats` count,
+        to be filled from the election's own.
+    '''#"""#'''
     def export(method):
         methods[name] = method
+        method.pairwise = pairwise
+        method.scores = scores
+        method.multiwinner = multiwinner
         __all__.append(method.__name__)
         return method
     return export
@@ -67,6 +92,41 @@ def unwind(ranks, candidates):
         if rank:
             yield rank
 
+def canonical(ranks, candidates):
+    r'''Normalizes a single ranking into a hashable form.
+        The result is a tuple of sorted tuples, one per rank,
+        containing only the keys in the `candidates` set.
+        A candidate listed more than once keeps its highest rank.
+    '''#"""#'''
+    seen = set()
+    result = []
+    for row in unwind(ranks, candidates):
+        row.difference_update(seen)
+        if row:
+            result.append(tuple(sorted(row)))
+            seen.update(row)
+    return tuple(result)
+
+def compress(votes, candidates):
+    r'''Merges ballots that would be counted identically.
+        Each ranking is normalized by canonical(), and the counts of
+        equal rankings are summed, so the methods see one entry per
+        distinct ballot.  Ballots that rank none of the candidates are
+        retained, because they still count toward the majority threshold.
+        Returns a list of (ranks, count) tuples, in order of first appearance.
+    '''#"""#'''
+    candidates = set(candidates)
+    totals = {}
+    order = []
+    for ranks, count in votes:
+        key = canonical(ranks, candidates)
+        if key in totals:
+            totals[key] += count
+        else:
+            totals[key] = count
+            order.append(key)
+    return [(key, totals[key]) for key in order]
+
 class Graph(object):
     r'''Basic graph structure.
         Designed for use by voting algorithms.
@@ -222,28 +282,701 @@ class Graph(object):
         '''#"""#'''
         return bool(self.vertices)
 
+class BitGraph(object):
+    r'''Graph structure backed by integer bitmasks.
+        Interchangeable with Graph, but also keeps the transitive closure
+        of its edges up to date, so checking whether a new edge would
+        create a cycle is a single bit test.
+    '''#"""#'''
+    
+    def __init__(self, vertices):
+        r'''Create a new BitGraph.
+            `vertices` is a sequence of distinct hashable objects.
+        '''#"""#'''
+        self.keys = list(vertices)
+        self.indexes = dict((v, n) for n, v in enumerate(self.keys))
+        size = len(self.keys)
+        self.bits = dict((1 << n, n) for n in range(size))
+        self.inbound = [0] * size
+        self.outbound = [0] * size
+        
+        # Vertices reachable from each vertex, and those reaching it.
+        self.descendants = [0] * size
+        self.ancestors = [0] * size
+        self.stale = False
+        
+        # Remaining vertices, and those without inbound edges.
+        self.alive = (1 << size) - 1
+        self.sources = self.alive
+    
+    def members(self, mask):
+        r'''Collect the vertex indexes in a bitmask.
+        '''#"""#'''
+        bits = self.bits
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            yield bits[bit]
+    
+    def connect(self, descendants, ancestors, source, sink):
+        r'''Update a transitive closure for a new edge.
+            `source` and `sink` are vertex indexes.
+        '''#"""#'''
+        below = descendants[sink] | (1 << sink)
+        above = (ancestors[source] | (1 << source)) & self.alive
+        for n in self.members(above):
+            descendants[n] |= below
+        for n in self.members(below & self.alive):
+            ancestors[n] |= above
+    
+    def refresh(self):
+        r'''Rebuild the transitive closure after edges were removed.
+        '''#"""#'''
+        if not self.stale:
+            return
+        
+        size = len(self.keys)
+        outbound = self.outbound
+        self.descendants = descendants = [0] * size
+        self.ancestors = ancestors = [0] * size
+        for n in self.members(self.alive):
+            seen = 0
+            frontier = outbound[n]
+            while frontier:
+                seen |= frontier
+                following = 0
+                for m in self.members(frontier):
+                    following |= outbound[m]
+                frontier = following & ~seen
+            descendants[n] = seen
+            for m in self.members(seen):
+                ancestors[m] |= 1 << n
+        self.stale = False
+    
+    def reaches(self, source, sink):
+        r'''Check whether a path leads from the source to the sink.
+        '''#"""#'''
+        self.refresh()
+        return bool(self.descendants[self.indexes[source]] & (1 << self.indexes[sink]))
+    
+    def edge(self, source, sink):
+        r'''Create an edge from the source to the sink.
+            This method provides no protections against cycles.
+        '''#"""#'''
+        a = self.indexes[source]
+        b = self.indexes[sink]
+        if not self.inbound[b] & (1 << a):
+            self.inbound[b] |= 1 << a
+            self.outbound[a] |= 1 << b
+            self.sources &= ~(1 << b)
+            if not self.stale:
+                self.connect(self.descendants, self.ancestors, a, b)
+        return True
+    
+    def _acyclic(self, edges):
+        # Determine which edges would be part of a cycle,
+        # if they were all added at once.
+        self.refresh()
+        descendants = list(self.descendants)
+        ancestors = list(self.ancestors)
+        indexes = self.indexes
+        for source, sink in edges:
+            self.connect(descendants, ancestors, indexes[source], indexes[sink])
+        
+        acyclic = set()
+        cyclic = set()
+        for source, sink in edges:
+            if descendants[indexes[sink]] & (1 << indexes[source]):
+                cyclic.add((source, sink))
+            else:
+                acyclic.add((source, sink))
+        return acyclic, cyclic
+    
+    def acyclic_edges(self, edges):
+        r'''Create edges from the (source, sink) pairs,
+            as long as the graph remains acyclic.
+            `edges` must be a sequence of vertex pairs.
+            Returns the number of edges created.
+        '''#"""#'''
+        acyclic, cyclic = self._acyclic(set(edges))
+        for source, sink in acyclic:
+            self.edge(source, sink)
+        return len(acyclic)
+    
+    def prune_cycles(self, edges):
+        r'''Remove any of the specified edges that participate in cycles.
+            `edges` must be a sequence of vertex pairs.
+            Returns a set of the edges removed.
+        '''#"""#'''
+        self.refresh()
+        cyclic = set()
+        for source, sink in edges:
+            if self.reaches(sink, source):
+                cyclic.add((source, sink))
+        
+        for source, sink in cyclic:
+            self.remove_edge(source, sink)
+        
+        return cyclic
+    
+    def river_edges(self, edges):
+        r'''Create each of the specified edges that would not
+            introduce a cycle or an outbound branching.
+            `edges` must be a sequence of vertex pairs.
+            Returns a set of edges that were not created.
+        '''#"""#'''
+        
+        # Group the edges by their outbound vertex.
+        sinks = defaultdict(set)
+        for source, sink in edges:
+            sinks[sink].add(source)
+        
+        # Collect any edges that don't create branches.
+        blocked = set()
+        candidates = set()
+        for sink in sinks:
+            sources = sinks[sink]
+            if self.inbound[self.indexes[sink]] or len(sources) > 1:
+                # Outbound branching detected.
+                for source in sources:
+                    blocked.add((source, sink))
+            else:
+                candidates.add((sources.pop(), sink))
+        
+        # Create the ones that don't introduce cycles.
+        acyclic, cyclic = self._acyclic(candidates)
+        for source, sink in acyclic:
+            self.edge(source, sink)
+        
+        return blocked | cyclic
+    
+    def edges(self):
+        r'''Collect all edges in the graph.
+        '''#"""#'''
+        keys = self.keys
+        for sink in self.members(self.alive):
+            for source in self.members(self.inbound[sink]):
+                yield keys[source], keys[sink]
+    
+    def roots(self):
+        r'''Collect the vertices with no inbound edges.
+            These are the roots of the tree, or the best choices.
+        '''#"""#'''
+        return [self.keys[n] for n in self.members(self.sources & self.alive)]
+    
+    def pop(self):
+        r'''Collect and remove root vertices in a single call.
+        '''#"""#'''
+        roots = self.sources & self.alive
+        self.alive &= ~roots
+        inbound = self.inbound
+        for n in self.members(roots):
+            for m in self.members(self.outbound[n]):
+                inbound[m] &= ~(1 << n)
+                if not inbound[m]:
+                    self.sources |= 1 << m
+            self.outbound[n] = 0
+        return set(self.keys[n] for n in self.members(roots))
+    
+    def paths(self, source, sink):
+        r'''Collect all paths from the source to the sink.
+            Tends to yield shorter paths first.
+        '''#"""#'''
+        keys = self.keys
+        start = self.indexes[source]
+        end = self.indexes[sink]
+        paths = deque([([end], self.inbound[end])])
+        while paths:
+            path, steps = paths.popleft()
+            for item in self.members(steps):
+                if item == start:
+                    yield [keys[n] for n in [item] + path]
+                elif item not in path:
+                    inbound = self.inbound[item]
+                    if inbound:
+                        paths.append(([item] + path, inbound))
+    
+    def remove_vertex(self, vertex):
+        r'''Remove a vertex from the graph.
+            Also removes any edges connected to that vertex.
+        '''#"""#'''
+        n = self.indexes[vertex]
+        bit = 1 << n
+        self.alive &= ~bit
+        for m in self.members(self.outbound[n]):
+            self.inbound[m] &= ~bit
+            if not self.inbound[m]:
+                self.sources |= 1 << m
+        for m in self.members(self.inbound[n]):
+            self.outbound[m] &= ~bit
+        if self.inbound[n] and self.outbound[n]:
+            self.stale = True
+        self.inbound[n] = 0
+        self.outbound[n] = 0
+    
+    def remove_edge(self, source, sink):
+        r'''Remove an edge from the graph.
+        '''#"""#'''
+        a = self.indexes[source]
+        b = self.indexes[sink]
+        if not self.inbound[b] & (1 << a):
+            raise KeyError(source)
+        self.inbound[b] &= ~(1 << a)
+        self.outbound[a] &= ~(1 << b)
+        if not self.inbound[b]:
+            self.sources |= 1 << b
+        self.stale = True
+    
+    def __nonzero__(self):
+        r'''Truth value for the graph.
+            A Graph is true if it contains any vertices.
+        '''#"""#'''
+        return bool(self.alive)
+
+def rank_levels(ranks, indexes):
+    r'''Convert a ballot into a list of rank levels, one per candidate.
+        `indexes` maps each candidate to its position in the list.
+        Unranked candidates get the number of candidates as a sentinel.
+    '''#"""#'''
+    size = len(indexes)
+    result = [size] * size
+    for level, row in enumerate(unwind(ranks, indexes)):
+        for candidate in row:
+            result[indexes[candidate]] = level
+    return result
+
+class PairwiseMatrix(object):
+    r'''Dense table of pairwise preference counts.
+        Candidates are mapped to integer indexes, and the number of ballots
+        ranking candidates[a] above candidates[b] is stored at a*n+b in a
+        flat array.  Uses NumPy when it's available, or the array module.
+    '''#"""#'''
+    
+    # Number of ballots to vectorize at once, to bound memory use.
+    chunk = 4096
+    
+    def __init__(self, candidates, counts=None):
+        r'''Create a new matrix.
+            `candidates` is a sequence of distinct hashable keys.
+            `counts` optionally supplies the flat list of initial counts,
+            as returned by tolist().
+        '''#"""#'''
+        self.candidates = list(candidates)
+        self.indexes = dict((key, n) for n, key in enumerate(self.candidates))
+        self.size = size = len(self.candidates)
+        if counts is None:
+            counts = [0] * (size * size)
+        elif len(counts) != size * size:
+            raise ValueError("Expected %d counts, got %d" % (size * size, len(counts)))
+        
+        if numpy is None:
+            self.counts = array("l", counts)
+        else:
+            self.counts = numpy.array(counts, dtype=numpy.int64)
+    
+    def tolist(self):
+        r'''Collect the counts into a flat list of integers.
+        '''#"""#'''
+        return self.counts.tolist()
+    
+    def restricted(self, candidates):
+        r'''Create a matrix over a different set of candidates.
+            Pairwise counts don't depend on the other candidates,
+            so this just copies the relevant cells; candidates
+            unknown to this matrix start with zero counts.
+        '''#"""#'''
+        candidates = list(candidates)
+        counts = self.tolist()
+        size = self.size
+        positions = [self.indexes.get(key) for key in candidates]
+        cells = []
+        for a in positions:
+            for b in positions:
+                if a is None or b is None:
+                    cells.append(0)
+                else:
+                    cells.append(counts[a * size + b])
+        return PairwiseMatrix(candidates, cells)
+    
+    def add(self, ranks, count=1):
+        r'''Count a single ballot.
+            A negative count removes a ballot counted earlier.
+        '''#"""#'''
+        indexes = self.indexes
+        rows = [[indexes[candidate] for candidate in row] for row in unwind(ranks, indexes)]
+        self.add_indexed(rows, count)
+    
+    def add_indexed(self, ranks, count=1):
+        r'''Count a single ballot of candidate indexes, as from Tally.indexed().
+            Each index must appear at most once.
+        '''#"""#'''
+        counts = self.counts
+        size = self.size
+        above = []
+        for row in ranks:
+            for b in row:
+                for a in above:
+                    counts[a * size + b] += count
+            above.extend(row)
+    
+    def update(self, votes):
+        r'''Count a sequence of (ranks, count) ballots.
+        '''#"""#'''
+        if numpy is None:
+            for ranks, count in votes:
+                self.add(ranks, count)
+            return
+        
+        rows = []
+        weights = []
+        for ranks, count in votes:
+            rows.append(self.positions(ranks))
+            weights.append(count)
+            if len(rows) >= self.chunk:
+                self._accumulate(rows, weights)
+                rows = []
+                weights = []
+        if rows:
+            self._accumulate(rows, weights)
+    
+    def positions(self, ranks):
+        r'''Convert a ballot into a list of rank levels, one per candidate,
+            as from rank_levels().
+        '''#"""#'''
+        return rank_levels(ranks, self.indexes)
+    
+    def accumulate(self, levels, weights):
+        r'''Count ballots given as a NumPy matrix of rank levels,
+            one row per ballot, and a vector of ballot counts.
+        '''#"""#'''
+        for start in xrange(0, len(weights), self.chunk):
+            end = start + self.chunk
+            self._accumulate(levels[start:end], weights[start:end])
+    
+    def _accumulate(self, rows, weights):
+        # One column of comparisons at a time keeps the intermediate
+        # arrays at ballots x candidates instead of ballots x pairs.
+        size = self.size
+        positions = numpy.asarray(rows, dtype=numpy.int32)
+        weights = numpy.asarray(weights, dtype=numpy.int64)
+        ranked = positions < size
+        for a in range(size):
+            wins = (positions[:, a:a+1] < positions) & ranked
+            self.counts[a*size:(a+1)*size] += numpy.dot(weights, wins)
+    
+    def __getitem__(self, pair):
+        r'''Number of ballots ranking the first candidate above the second.
+        '''#"""#'''
+        a, b = pair
+        return int(self.counts[self.indexes[a] * self.size + self.indexes[b]])
+    
+    def majorities(self):
+        r'''Collects the pairwise majorities.
+            Returns a dictionary of (winner, loser) => (major, minor).
+        '''#"""#'''
+        if numpy is None:
+            counts = self.counts
+        else:
+            counts = self.counts.tolist()
+        
+        size = self.size
+        candidates = self.candidates
+        majorities = {}
+        for a in xrange(size):
+            for b in xrange(size):
+                major = counts[a * size + b]
+                minor = counts[b * size + a]
+                if major > minor:
+                    majorities[candidates[a], candidates[b]] = (major, minor)
+        
+        return majorities
+
+class BallotTrie(object):
+    r'''Prefix tree of ballots, merging the ranks they start with in common.
+        Each node holds one rank, as a tuple of candidate indexes, and the
+        number of ballots whose rankings start with the ranks leading down
+        to it; its children map each following rank to another node.
+        The root holds an empty rank, and counts every ballot.
+    '''#"""#'''
+    
+    # Large elections can have a node for nearly every ranking.
+    __slots__ = ("rank", "count", "children")
+    
+    def __init__(self, rank=()):
+        self.rank = rank
+        self.count = 0
+        self.children = {}
+    
+    def add(self, ranks, count=1):
+        r'''Count a ballot, given as a sequence of rank tuples.
+        '''#"""#'''
+        node = self
+        node.count += count
+        for rank in ranks:
+            child = node.children.get(rank)
+            if child is None:
+                child = node.children[rank] = BallotTrie(rank)
+            child.count += count
+            node = child
+    
+    def size(self):
+        r'''Count the nodes in this tree, including this one.
+        '''#"""#'''
+        return 1 + sum(child.size() for child in self.children.itervalues())
+
+class Tally(object):
+    r'''Ballot summaries shared between voting methods.
+        Each summary is computed from the normalized ballots on first use,
+        then cached, so evaluating several methods over the same ballots
+        reads them only once.  Every registered method accepts a Tally in
+        place of its `votes` parameter; iterating over a Tally yields the
+        normalized (ranks, count) ballots.
+    '''#"""#'''
+    
+    def __init__(self, votes, candidates):
+        r'''Create a new Tally.
+            `votes` and `candidates` are as for the voting methods.
+            The votes are not read until a summary is requested.
+        '''#"""#'''
+        self.votes = votes
+        self.candidates = list(candidates)
+        self.cache = {}
+    
+    def cached(function):
+        def wrapper(self):
+            name = function.__name__
+            try:
+                return self.cache[name]
+            except KeyError:
+                result = self.cache[name] = function(self)
+                return result
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    
+    @classmethod
+    def from_matrix(cls, matrix):
+        r'''Create a Tally from stored pairwise counts alone.
+            Only methods registered with pairwise=True can use it;
+            asking it for ballots raises ValueError.
+        '''#"""#'''
+        tally = cls(None, matrix.candidates)
+        tally.cache["matrix"] = matrix
+        return tally
+    
+    def matches(self, candidates):
+        r'''Check whether this Tally covers the same candidate set.
+        '''#"""#'''
+        return set(self.candidates) == set(candidates)
+    
+    def restricted(self, candidates):
+        r'''Create a Tally of the same ballots for other candidates.
+            A Tally without ballots restricts its pairwise matrix instead.
+        '''#"""#'''
+        if self.votes is None and "ballots" not in self.cache:
+            return Tally.from_matrix(self.matrix().restricted(candidates))
+        return Tally(self.ballots(), candidates)
+    
+    @cached
+    def ballots(self):
+        r'''The list of distinct (ranks, count) ballots, from compress().
+        '''#"""#'''
+        if self.votes is None:
+            raise ValueError("This tally holds no ballots.")
+        done = stats.phase("ballots")
+        ballots = compress(self.votes, self.candidates)
+        self.votes = None
+        done()
+        stats.count("ballots.distinct", len(ballots))
+        return ballots
+    
+    @cached
+    def indexed(self):
+        r'''The distinct ballots, with each candidate replaced by its index.
+            Candidate candidates[n] becomes n, so each ranking is a tuple of
+            tuples of small integers, and the summaries and methods can keep
+            their counts in lists instead of dictionaries keyed by candidate.
+            Returns a list of (ranks, count) tuples, in the order of ballots().
+        '''#"""#'''
+        indexes = dict((key, n) for n, key in enumerate(self.candidates))
+        return [(tuple(tuple(indexes[key] for key in row) for row in ranks), count)
+            for ranks, count in self.ballots()]
+    
+    @cached
+    def trie(self):
+        r'''The indexed ballots, merged into a BallotTrie.
+        '''#"""#'''
+        done = stats.phase("trie")
+        trie = BallotTrie()
+        for ranks, count in self.indexed():
+            trie.add(ranks, count)
+        done()
+        return trie
+    
+    @cached
+    def total(self):
+        r'''The number of ballots cast.
+        '''#"""#'''
+        return sum(count for ranks, count in self.ballots())
+    
+    @cached
+    def matrix(self):
+        r'''The PairwiseMatrix of preferences.
+        '''#"""#'''
+        if numpy is None:
+            ballots = self.indexed()
+        else:
+            levels, weights = self.levels()
+        done = stats.phase("pairwise")
+        matrix = PairwiseMatrix(self.candidates)
+        if numpy is None:
+            for ranks, count in ballots:
+                matrix.add_indexed(ranks, count)
+        else:
+            matrix.accumulate(levels, weights)
+        done()
+        return matrix
+    
+    @cached
+    def levels(self):
+        r'''The ballots as NumPy arrays, for the vectorized summaries.
+            Returns a matrix with a row of rank levels per distinct ballot,
+            as from rank_levels(), and the vector of ballot counts.
+            Only available when NumPy is.
+        '''#"""#'''
+        ballots = self.indexed()
+        size = len(self.candidates)
+        levels = numpy.empty((len(ballots), size), dtype=numpy.int32)
+        levels.fill(size)
+        for n, (ranks, count) in enumerate(ballots):
+            row = levels[n]
+            for level, rank in enumerate(ranks):
+                row[list(rank)] = level
+        weights = numpy.array([count for ranks, count in ballots], dtype=numpy.int64)
+        return levels, weights
+    
+    def _level_sizes(self):
+        # The number of candidates at each level of each ballot,
+        # with a final column for the unranked candidates.
+        levels, weights = self.levels()
+        count, size = levels.shape
+        sizes = numpy.zeros((count, size + 1), dtype=numpy.int64)
+        rows = numpy.arange(count)
+        for column in xrange(size):
+            sizes[rows, levels[:, column]] += 1
+        return sizes
+    
+    @cached
+    def majorities(self):
+        r'''The pairwise majorities, as returned by pairwise().
+            The dictionary is shared, so callers must not modify it.
+        '''#"""#'''
+        return self.matrix().majorities()
+    
+    @cached
+    def first(self):
+        r'''First-preference totals for each candidate.
+            Equal first preferences divide the ballot evenly; to keep the
+            totals exact integers, every total is scaled by the least
+            common multiple of the tied rank sizes.
+        '''#"""#'''
+        if numpy is None:
+            return self._scalar_first()
+        return self._vector_first()
+    
+    def _scalar_first(self):
+        shares = [defaultdict(int) for key in self.candidates]
+        for ranks, count in self.indexed():
+            if ranks:
+                size = len(ranks[0])
+                for n in ranks[0]:
+                    shares[n][size] += count
+        
+        scale = multiple(size for share in shares for size in share)
+        return dict((key, sum(share[size] * (scale // size) for size in share))
+            for key, share in zip(self.candidates, shares))
+    
+    def _vector_first(self):
+        # Count the first preferences for each tie size in NumPy, where
+        # they stay within the ballot total, but scale them as Python
+        # integers; the common multiple can overflow a 64-bit integer.
+        levels, weights = self.levels()
+        tied = self._level_sizes()[:, 0]
+        first = levels == 0
+        sizes = numpy.unique(tied[tied > 0]).tolist()
+        scale = multiple(sizes)
+        totals = [0] * len(self.candidates)
+        for size in sizes:
+            counts = numpy.dot(weights * (tied == size), first).tolist()
+            for n, count in enumerate(counts):
+                totals[n] += count * (scale // size)
+        return dict(zip(self.candidates, totals))
+    
+    @cached
+    def borda(self):
+        r'''Positional ratings for each candidate.
+            The over/under count system makes each ballot zero-sum: each
+            candidate loses a point per candidate ranked above it, and gains
+            a point per candidate ranked below it.
+        '''#"""#'''
+        if numpy is None:
+            return self._scalar_borda()
+        return self._vector_borda()
+    
+    def _scalar_borda(self):
+        ratings = [0] * len(self.candidates)
+        for ranks, count in self.indexed():
+            # First, subtract points for each candidate ranked higher.
+            seen = 0
+            for row in ranks:
+                value = count * seen
+                seen += len(row)
+                for n in row:
+                    ratings[n] -= value
+            
+            # Second, add points for each candidate ranked lower.
+            for row in ranks:
+                seen -= len(row)
+                value = count * seen
+                for n in row:
+                    ratings[n] += value
+        return dict(zip(self.candidates, ratings))
+    
+    def _vector_borda(self):
+        # Each candidate's score on a ballot is the number of candidates
+        # ranked below it, less the number ranked above it.
+        levels, weights = self.levels()
+        count, size = levels.shape
+        sizes = self._level_sizes()
+        rows = numpy.arange(count)[:, None]
+        through = numpy.cumsum(sizes, axis=1)[rows, levels]
+        above = through - sizes[rows, levels]
+        below = (size - sizes[:, size])[:, None] - through
+        scores = (below - above) * (levels < size)
+        ratings = numpy.dot(weights, scores)
+        return dict(zip(self.candidates, ratings.tolist()))
+    
+    del cached
+    
+    def __iter__(self):
+        return iter(self.ballots())
+
+def tabulate(votes, candidates):
+    r'''Wraps the votes in a Tally, unless they already are one.
+        A Tally for a different candidate set is restricted to these.
+    '''#"""#'''
+    if isinstance(votes, Tally):
+        if votes.matches(candidates):
+            return votes
+        return votes.restricted(candidates)
+    return Tally(votes, candidates)
+
 def pairwise(votes, candidates):
     r'''Collects pairwise majorities from the ballots.
         Returns a dictionary of (winner, loser) => (major, minor),
         suitable for passing into regrouped().
     '''#"""#'''
-    comparisons = defaultdict(int)
-    for ranks, count in votes:
-        above = set()
-        for row in unwind(ranks, candidates):
-            for candidate in row:
-                for former in above:
-                    comparisons[former, candidate] += count
-            above.update(row)
-    
-    majorities = {}
-    for a,b in comparisons:
-        major = comparisons[a, b]
-        minor = comparisons.get((b, a), 0)
-        if major > minor:
-            majorities[a, b] = (major, minor)
-    
-    return majorities
+    return tabulate(votes, candidates).majorities()
 
 def regrouped(mapping, reverse=True):
     r'''Collects sets of keys with identical values,
@@ -256,6 +989,37 @@ def regrouped(mapping, reverse=True):
     for value in sorted(counts, reverse=reverse):
         yield counts[value]
 
+def multiple(numbers):
+    r'''Finds the least common multiple of a sequence of positive integers.
+        Returns 1 for an empty sequence.
+    '''#"""#'''
+    result = 1
+    for number in set(numbers):
+        a, b = result, number
+        while b:
+            a, b = b, a % b
+        result = result // a * number
+    return result
+
+def limit(top):
+    r'''Counts off the ranks allowed by a method's `top` limit.
+        Counts forever when `top` is None.
+        Rejects negative limits with ValueError, as truncated() does.
+    '''#"""#'''
+    if top is not None and top < 0:
+        raise ValueError("top must be None or at least zero, not %r" % (top,))
+    n = 0
+    while top is None or n < top:
+        yield n
+        n += 1
+
+def truncated(ranks, top):
+    r'''Lists the first `top` ranks, or all of them when `top` is None.
+        Rejects negative limits with ValueError, instead of slicing
+        from the end.
+    '''#"""#'''
+    return list(islice(ranks, top))
+
 def pairs(sequence):
     r'''Yield each pair of the sequence exactly once, preserving order.
         For example, if "A" follows "B" are in the sequence, the result
@@ -266,47 +1030,86 @@ def pairs(sequence):
         for a in xrange(0, b):
             yield items[a], items[b]
 
-@method("Ranked Pairs")
-def rankedpairs(votes, candidates):
+@method("Ranked Pairs", pairwise=True)
+def rankedpairs(votes, candidates, top=None):
     # Tideman method, using a graph of preferences data.
     # Modified by ignoring unstated candidates, instead of
     # assuming that they're all worse than the ranked ones.
     majorities = pairwise(votes, candidates)
-    graph = Graph(candidates)
+    done = stats.phase("rankedpairs.lock")
+    graph = BitGraph(candidates)
+    offered = locked = 0
     for rank in regrouped(majorities):
-        graph.acyclic_edges(rank)
+        offered += len(rank)
+        locked += graph.acyclic_edges(rank)
+    done()
+    stats.count("rankedpairs.locked", locked)
+    stats.count("rankedpairs.pruned", offered - locked)
     
-    while graph:
+    for n in limit(top):
+        if not graph:
+            break
         winners = graph.pop()
         yield winners
 
 @method("Instant-Runoff")
-def instantrunoff(votes, candidates):
+def instantrunoff(votes, candidates, top=None):
     # Instant Runoff Voting (IRV)
     # Modified to return a total ordering.
-    candidates = set(candidates)
-    majority = sum(item[1] for item in votes) / 2
+    # With a `top` limit, stops once that many ranks have won a majority.
+    # Ballots that start with the same ranks share a node of the ballot
+    # trie, counted for the remaining candidates of its rank; each round
+    # only needs to move the nodes of the removed candidates, on to their
+    # children once their rank has no remaining candidates.
+    # Candidates are counted by their indexes in the tally.
+    tally = tabulate(votes, candidates)
+    keys = tally.candidates
+    candidates = set(xrange(len(keys)))
+    total = tally.total()
+    
+    # The remaining candidates of each counted node's rank.
+    preferred = {}
+    # The nodes currently counted for each candidate.
+    piles = [set() for key in keys]
+    # The number of votes for each candidate, by the size of its rank.
+    shares = [defaultdict(int) for key in keys]
+    
+    def place(node):
+        rank = candidates.intersection(node.rank)
+        if rank:
+            preferred[node] = rank
+            size = len(rank)
+            for candidate in rank:
+                piles[candidate].add(node)
+                shares[candidate][size] += node.count
+        else:
+            for child in node.children.itervalues():
+                place(child)
+    
+    place(tally.trie())
     
     winners = []
     losers = []
-    while candidates:
-        totals = dict.fromkeys(candidates, 0)
-        for ranks, count in votes:
-            for row in unwind(ranks, candidates):
-                # Divide the votes evenly among the preferences.
-                value = count / len(row)
-                for candidate in row:
-                    totals[candidate] += value
-                break
+    rounds = transferred = 0
+    while candidates and (top is None or len(winners) < top):
+        rounds += 1
+        # Divide the votes evenly among the preferences.  Scaling every
+        # total by a common multiple of the rank sizes keeps them exact.
+        scale = multiple(size for key in candidates
+            for size in shares[key] if shares[key][size])
+        totals = {}
+        for key in candidates:
+            share = shares[key]
+            totals[key] = sum(share[size] * (scale // size) for size in share)
         
         counts = defaultdict(set)
         for key in totals:
             counts[totals[key]].add(key)
         
-        top = max(counts)
-        if top > majority:
+        highest = max(counts)
+        if highest * 2 > total * scale:
             # We have a winner!
-            found = counts[top]
+            found = counts[highest]
             winners.append(found)
         else:
             # Eliminate the losers.
@@ -315,151 +1118,332 @@ def instantrunoff(votes, candidates):
         
         # Remove ranked candidates from the list
         candidates.difference_update(found)
+        
+        # Transfer their ballots to the next remaining preferences.
+        transfers = set()
+        for key in found:
+            transfers.update(piles[key])
+        transferred += len(transfers)
+        for node in transfers:
+            rank = preferred.pop(node)
+            size = len(rank)
+            for candidate in rank & candidates:
+                piles[candidate].discard(node)
+                shares[candidate][size] -= node.count
+            place(node)
+    
+    stats.count("instantrunoff.rounds", rounds)
+    stats.count("instantrunoff.transfers", transferred)
+    return [set(keys[n] for n in rank) for rank in truncated(winners + losers, top)]
+
+@method("Single Transferable Vote", multiwinner=True)
+def stv(votes, candidates, top=None, seats=1):
+    # Multi-winner STV, with the Droop quota and Gregory transfers:
+    # each elected candidate passes on the part of every ballot it holds
+    # that exceeds the quota, instead of a sample of whole ballots.
+    # Elects `seats` candidates, one unless the caller asks for more;
+    # the rest follow by their final totals, then in elimination order.
+    # Ballots that start with the same ranks share a node of the ballot
+    # trie, each of them worth an integer count of 1/precision of a vote.
+    # Like the Scottish STV rules, transfers truncate to that precision,
+    # which discards a little of each surplus but keeps every value the
+    # same size however many seats are filled; exact fractions would
+    # grow with every transfer.
+    precision = 100000
+    tally = tabulate(votes, candidates)
+    keys = tally.candidates
+    hopeful = set(xrange(len(keys)))
+    quota = tally.total() // (seats + 1) + 1
+    
+    # The hopeful candidates of each counted node's rank.
+    preferred = {}
+    # The current value of each ballot at each counted node.
+    values = {}
+    # The nodes currently counted for each candidate.
+    piles = [set() for key in keys]
+    
+    def place(node, value):
+        rank = hopeful.intersection(node.rank)
+        if rank:
+            preferred[node] = rank
+            values[node] = value
+            for candidate in rank:
+                piles[candidate].add(node)
+        else:
+            for child in node.children.itervalues():
+                place(child, value)
+    
+    def replace(node, value):
+        # Move a node on past the candidates no longer hopeful.
+        for candidate in preferred.pop(node):
+            piles[candidate].discard(node)
+        del values[node]
+        if value:
+            place(node, value)
+    
+    def standings():
+        # Divide each ballot evenly among its preferences.  Scaling every
+        # total by a common multiple of the rank sizes keeps them exact.
+        scale = multiple(len(preferred[node]) for key in hopeful for node in piles[key])
+        totals = {}
+        for key in hopeful:
+            totals[key] = sum(node.count * values[node] * (scale // len(preferred[node]))
+                for node in piles[key])
+        return scale, totals
+    
+    place(tally.trie(), precision)
+    elected = []
+    losers = []
+    seated = rounds = 0
+    while hopeful and seated < seats and (top is None or len(elected) < top):
+        rounds += 1
+        scale, totals = standings()
+        
+        found = set(key for key in hopeful if totals[key] >= quota * precision * scale)
+        if not found and len(hopeful) + seated <= seats:
+            # Everyone left gets a seat.
+            found = set(hopeful)
+        
+        nodes = set()
+        for key in found:
+            nodes.update(piles[key])
+        
+        if found:
+            elected.extend(regrouped(dict((key, totals[key]) for key in found)))
+            seated += len(found)
+            hopeful.difference_update(found)
+            
+            # Each surplus is a fraction, surplus/held, of the winner's
+            # votes.  Each node passes on that much of its winners' shares,
+            # rounded down, and keeps the shares of its other candidates.
+            surpluses = {}
+            for key in found:
+                held = totals[key]
+                surpluses[key] = (max(held - quota * precision * scale, 0), held or 1)
+            
+            for node in nodes:
+                rank = preferred[node]
+                winners = rank & found
+                value = values[node]
+                kept = value * (len(rank) - len(winners)) // len(rank)
+                for key in winners:
+                    surplus, held = surpluses[key]
+                    kept += value * surplus // (held * len(rank))
+                replace(node, kept)
+        else:
+            # Eliminate the losers, passing on their ballots whole.
+            lowest = min(totals.itervalues())
+            found = set(key for key in hopeful if totals[key] == lowest)
+            losers.insert(0, found)
+            hopeful.difference_update(found)
+            for key in found:
+                nodes.update(piles[key])
+            for node in nodes:
+                replace(node, values[node])
+    
+    stats.count("stv.rounds", rounds)
     
-    return winners + losers
+    # Candidates left without a seat follow by their final totals.
+    scale, totals = standings()
+    ranks = elected + list(regrouped(totals)) + losers
+    return [set(keys[n] for n in rank) for rank in truncated(ranks, top)]
 
 @method("Plurality")
-def plurality(votes, candidates):
+def plurality(votes, candidates, top=None):
     # First past the post, winner takes all.
     # Only the top preference is even looked at.
-    totals = dict.fromkeys(candidates, 0)
-    for ranks, count in votes:
-        for row in unwind(ranks, candidates):
-            value = count / len(row)
-            for candidate in row:
-                totals[candidate] += value
-            break
-    
-    return [rank for rank in regrouped(totals)]
+    totals = tabulate(votes, candidates).first()
+    return truncated(regrouped(totals), top)
 
 @method("Borda Count")
-def borda(votes, candidates):
+def borda(votes, candidates, top=None):
     # Borda Count method.
     # The over/under count system makes each ballot zero-sum, which allows
     # incomplete ballots to have less impact on unranked candidates.
-    ratings = dict.fromkeys(candidates, 0)
-    for ranks, count in votes:
-        # First, subtract points for each candidate ranked higher.
-        seen = 0
-        for row in unwind(ranks, candidates):
-            value = count * seen
-            seen += len(row)
-            for candidate in row:
-                ratings[candidate] -= value
-        
-        # Second, add points for each candidate ranked lower.
-        for row in unwind(ranks, candidates):
-            seen -= len(row)
-            value = count * seen
-            for candidate in row:
-                ratings[candidate] += value
-    
-    return [rank for rank in regrouped(ratings)]
+    ratings = tabulate(votes, candidates).borda()
+    return truncated(regrouped(ratings), top)
 
 @method("Bucklin")
-def bucklin(votes, candidates):
+def bucklin(votes, candidates, top=None):
     # The Bucklin or Grand Junction voting system.
     # Seems to work well for three candidates, but not more.
-    majority = sum(item[1] for item in votes) / 2
+    tally = tabulate(votes, candidates)
+    ballots = tally.total()
+    keys = tally.candidates
+    depth = len(keys)
     
-    for n in range(1, len(candidates) + 1):
-        totals = dict.fromkeys(candidates, 0)
-        for ranks, count in votes:
-            seen = 0
-            for row in unwind(ranks, candidates):
-                if len(row) > n - seen:
-                    # Divide the votes evenly among the preferences.
-                    # Letting each one count fully would let some ballots
-                    # count more than others.
-                    value = count * (n - seen) / len(row)
-                else:
-                    value = count
-                
-                for candidate in row:
-                    totals[candidate] += value
-                
-                seen += len(row)
-                if seen >= n:
-                    break
-        
+    # A single pass over the ballot trie records where each candidate's
+    # votes start and stop accumulating, for every ballot through a node
+    # at once.  A rank spanning depths from seen+1 to seen+size
+    # gains count/size votes per depth, dividing the votes evenly among
+    # the preferences; letting each one count fully would let some
+    # ballots count more than others.  Per-depth changes are collected
+    # by rank size, as integer multiples of count/size.
+    slopes = [{} for key in keys]
+    nodes = [(child, 0) for child in tally.trie().children.itervalues()]
+    while nodes:
+        node, seen = nodes.pop()
+        count = node.count
+        size = len(node.rank)
+        for candidate in node.rank:
+            slope = slopes[candidate].get(size)
+            if slope is None:
+                slope = slopes[candidate][size] = [0] * (depth + 2)
+            slope[seen + 1] += count
+            if seen + size < depth:
+                slope[seen + size + 1] -= count
+        seen += size
+        if seen < depth:
+            nodes.extend((child, seen) for child in node.children.itervalues())
+    
+    # Prefix sums of the slopes give the totals at each depth.
+    # Scaling every total by a common multiple of the rank sizes
+    # keeps the comparisons exact.
+    scale = multiple(size for slope in slopes for size in slope)
+    majority = ballots * scale
+    rates = [defaultdict(int) for key in keys]
+    levels = [defaultdict(int) for key in keys]
+    for n in range(1, depth + 1):
         counts = defaultdict(set)
-        for key in totals:
-            counts[totals[key]].add(key)
+        for index, key in enumerate(keys):
+            rate = rates[index]
+            level = levels[index]
+            for size, slope in slopes[index].iteritems():
+                rate[size] += slope[n]
+                level[size] += rate[size]
+            counts[sum(level[size] * (scale // size) for size in level)].add(key)
         
         result = sorted(counts, reverse=True)
-        if result[0] > majority:
+        if result[0] * 2 > majority:
             # We have a winner!
-            return [counts[total] for total in result]
+            stats.count("bucklin.rounds", n)
+            return [counts[total] for total in truncated(result, top)]
     else:
         # No majority exists.
         # This might not be the best result,
         # but I'm not sure how to better express the lack of majority.
-        return [candidates]
+        stats.count("bucklin.rounds", depth)
+        return truncated([candidates], top)
 
-@method("Minimax")
-def minimax(votes, candidates):
+def defeats(majorities, candidates):
+    r'''Collects the pairwise defeats of each candidate.
+        Returns a dictionary of candidate => [(strength, winner), ...],
+        sorted from weakest to strongest, where strength is (major, minor).
+    '''#"""#'''
+    result = dict((key, []) for key in candidates)
+    for winner, loser in majorities:
+        result[loser].append((majorities[winner, loser], winner))
+    for key in result:
+        result[key].sort()
+    return result
+
+def minimax_scores(votes, candidates):
+    r'''Finds the strongest pairwise defeat of each candidate.
+        Returns a dictionary of candidate => (major, minor),
+        with zero for candidates that are never defeated.
+        The candidates with the lowest score win under minimax().
+    '''#"""#'''
+    losses = defeats(pairwise(votes, candidates), candidates)
+    return dict((key, losses[key] and losses[key][-1][0] or 0) for key in losses)
+
+@method("Minimax", pairwise=True, scores=minimax_scores)
+def minimax(votes, candidates, top=None):
     # Minimax / Successive reversal / Simpson method.
     # Using rankings, select unbeaten candidates.
     # If there aren't any, drop the weakest wins.
-    majorities = pairwise(votes, candidates)
-    graph = Graph(candidates)
-    for a, b in majorities:
-        graph.edge(a, b)
+    # Dropping every defeat up to some threshold leaves unbeaten exactly
+    # those candidates whose worst remaining defeat is within it, so each
+    # rank needs only the strongest defeat by a remaining candidate.
+    losses = defeats(pairwise(votes, candidates), candidates)
+    remaining = set(candidates)
+    threshold = 0
+    for n in limit(top):
+        if not remaining:
+            break
+        worst = {}
+        for key in remaining:
+            lost = losses[key]
+            while lost and lost[-1][1] not in remaining:
+                lost.pop()
+            worst[key] = lost and lost[-1][0] or 0
+        
+        lowest = min(worst.values())
+        if lowest > threshold:
+            threshold = lowest
+        
+        winners = set(key for key in remaining if worst[key] <= threshold)
+        remaining.difference_update(winners)
+        stats.count("minimax.rounds")
+        yield winners
+
+def strongest_paths(majorities, candidates):
+    r'''Computes the strength of the strongest path between each pair.
+        The strength of a path is its weakest majority; pairs without
+        any path have a strength of zero.  Uses the Floyd-Warshall
+        widest path algorithm, taking O(n**3) time.
+        Returns a dictionary of (source, sink) => strength.
+    '''#"""#'''
+    candidates = list(candidates)
+    size = len(candidates)
+    strengths = [[majorities.get((a, b), 0) for b in candidates] for a in candidates]
     
-    groups = regrouped(majorities, False)
-    while graph:
-        winners = graph.pop()
-        if winners:
-            yield winners
-        else:
-            for sink, source in next(groups):
-                if (sink, source) in graph.edges():
-                    graph.remove_edge(sink, source)
+    done = stats.phase("paths")
+    explored = 0
+    for k in range(size):
+        through = strengths[k]
+        for i in range(size):
+            if i == k:
+                continue
+            row = strengths[i]
+            first = row[k]
+            if not first:
+                continue
+            explored += 1
+            for j in range(size):
+                if j == i or j == k:
+                    continue
+                second = through[j]
+                path = first if first < second else second
+                if path > row[j]:
+                    row[j] = path
+    done()
+    stats.count("paths.explored", explored)
+    
+    result = {}
+    for i, a in enumerate(candidates):
+        for j, b in enumerate(candidates):
+            if i != j:
+                result[a, b] = strengths[i][j]
+    return result
 
-@method("Beatpath")
-def beatpath(votes, candidates):
+@method("Beatpath", pairwise=True)
+def beatpath(votes, candidates, top=None):
     # Schulze method, equivalent to Cloneproof Schwartz Sequential Dropping.
     majorities = pairwise(votes, candidates)
-    graph = Graph(candidates)
-    for a, b in majorities:
-        graph.edge(a, b)
-    
-    def path_steps(path):
-        sequence = iter(path)
-        prev = next(sequence)
-        for item in sequence:
-            yield prev, item
-            prev = item
-    
-    def beat_strength(source, sink):
-        # max() doesn't like empty iterables.
-        strength = 0
-        for path in graph.paths(source, sink):
-            path_strength = min(majorities[step]
-                for step in path_steps(path))
-            if path_strength > strength:
-                strength = path_strength
-        return strength
+    strengths = strongest_paths(majorities, candidates)
     
     final = Graph(candidates)
     for source, sink in pairs(candidates):
-        major = beat_strength(sink, source)
-        minor = beat_strength(source, sink)
+        major = strengths[sink, source]
+        minor = strengths[source, sink]
         if major > minor:
             final.edge(sink, source)
         elif minor > major:
             final.edge(source, sink)
     
-    while final:
+    for n in limit(top):
+        if not final:
+            break
         winners = final.pop()
         yield winners
 
-@method("River")
-def river(votes, candidates):
+@method("River", pairwise=True)
+def river(votes, candidates, top=None):
     # A compromize between Beatpath and Ranked Pairs
     # http://web.archive.org/web/20071031155527/http://lists.electorama.com/pipermail/election-methods-electorama.com/2004-October/013971.html
     majorities = pairwise(votes, candidates)
-    graph = Graph(candidates)
+    done = stats.phase("river.lock")
+    graph = BitGraph(candidates)
     retries = []
     for rank in regrouped(majorities):
         result = graph.river_edges(rank)
@@ -467,58 +1451,177 @@ def river(votes, candidates):
             retries.append(result)
     
     # Attempt a more total ordering.
+    retried = locked = 0
     for rank in retries:
-        graph.acyclic_edges(rank)
+        retried += len(rank)
+        locked += graph.acyclic_edges(rank)
+    done()
+    stats.count("river.retried", retried)
+    stats.count("river.relocked", locked)
     
-    while graph:
+    for n in limit(top):
+        if not graph:
+            break
         winners = graph.pop()
         yield winners
 
-@method("Kemeny-Young")
-def kemeny(votes, candidates):
+def collapsed(positions):
+    r'''Collapses sets of possible candidates at each position into ranks.
+        `positions` is a sequence of sets, where each set holds every
+        candidate that appears at that position in some optimal ordering.
+        Consecutive positions are merged until their members fill them.
+    '''#"""#'''
+    ties = 0
+    tied = set()
+    result = []
+    for winners in positions:
+        ties += 1
+        tied.update(winners)
+        if len(tied) == ties:
+            result.append(tied)
+            ties = 0
+            tied = set()
+    return result
+
+@method("Kemeny-Young", pairwise=True)
+def kemeny(votes, candidates, top=None):
     # Kemeny-Young maximum likelihood method.
     # http://en.wikipedia.org/wiki/Kemeny-Young_method
+    # Instead of scoring every permutation, this finds the best ordering
+    # of each subset of candidates, adding one candidate at a time.
+    candidates = list(candidates)
+    size = len(candidates)
+    if size > 20:
+        # Even the subset tables would take entirely too long to fill.
+        return truncated([tuple(candidates)], top)
     
-    if len(candidates) > 6:
-        # This calculation would take entirely too long.
-        # There are ways to optimize it, but they get a little nuts.
-        return [tuple(candidates)]
+    matrix = tabulate(votes, candidates).matrix()
+    comparisons = [[matrix[a, b] for b in candidates] for a in candidates]
     
-    comparisons = defaultdict(int)
-    for ranks, count in votes:
-        above = set()
-        for row in unwind(ranks, candidates):
-            for candidate in row:
-                for former in above:
-                    comparisons[former, candidate] += count
-            above.update(row)
+    # gain(S, c), the score for placing c directly after the subset S,
+    # is split into tables for the low and high halves of the bitmask.
+    half = size // 2
+    lowmask = (1 << half) - 1
+    bits = dict((1 << n, n) for n in range(size))
+    def gains(members, offset):
+        tables = []
+        for c in range(size):
+            table = [0]
+            for n in range(members):
+                weight = comparisons[offset + n][c]
+                table.extend([value + weight for value in table])
+            tables.append(table)
+        return tables
+    low = gains(half, 0)
+    high = gains(size - half, half)
+    ones = [0]
+    for n in range(size - half):
+        ones.extend([value + 1 for value in ones])
+    
+    # best[S] is the score of the best ordering of the subset S alone.
+    done = stats.phase("kemeny.subsets")
+    full = (1 << size) - 1
+    stats.count("kemeny.subsets", full + 1)
+    best = [0] * (full + 1)
+    for subset in xrange(1, full + 1):
+        lowbits = subset & lowmask
+        highbits = subset >> half
+        score = None
+        remaining = subset
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            c = bits[bit]
+            total = best[subset ^ bit] + low[c][lowbits] + high[c][highbits]
+            if score is None or total > score:
+                score = total
+        best[subset] = score
+    
+    # rest[S] is the score of the best ordering of everyone after S.
+    # Along the way, note which candidates can fill each position.
+    optimum = best[full]
+    rest = [0] * (full + 1)
+    positions = [set() for c in candidates]
+    for subset in xrange(full - 1, -1, -1):
+        lowbits = subset & lowmask
+        highbits = subset >> half
+        score = None
+        remaining = full ^ subset
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            c = bits[bit]
+            total = low[c][lowbits] + high[c][highbits] + rest[subset | bit]
+            if score is None or total > score:
+                score = total
+        rest[subset] = score
+        
+        if best[subset] + score == optimum:
+            rank = ones[lowbits] + ones[highbits]
+            for c in range(size):
+                bit = 1 << c
+                if not subset & bit:
+                    gain = low[c][lowbits] + high[c][highbits]
+                    if best[subset] + gain + rest[subset | bit] == optimum:
+                        positions[rank].add(candidates[c])
+    done()
+    
+    return truncated(collapsed(positions), top)
+
+def kemeny_permutations(votes, candidates):
+    r'''Reference implementation of kemeny(), scoring every permutation.
+        Only practical for a handful of candidates; kept for verification.
+    '''#"""#'''
+    matrix = tabulate(votes, candidates).matrix()
     
     maximum = 0
     finalists = []
     for perm in permutations(candidates):
-        total = sum(comparisons[a, b] for a, b in pairs(perm))
+        total = sum(matrix[a, b] for a, b in pairs(perm))
         if total > maximum:
             maximum = total
             finalists = [perm]
         elif total == maximum:
             finalists.append(perm)
     
-    if len(finalists) == 1:
-        # Shortcut for an unambiguous result
-        result = [[item] for item in finalists[0]]
-    else:
-        # Collapse the ties.
-        ties = 0
-        tied = set()
-        result = []
-        for rank in range(len(candidates)):
-            winners = set(finalist[rank] for finalist in finalists)
-            ties += 1
-            tied.update(winners)
-            if len(tied) == ties:
-                result.append(tied)
-                ties = 0
-                tied = set()
-    
-    return result
+    return collapsed(set(finalist[rank] for finalist in finalists)
+        for rank in range(len(candidates)))
 
+def beatpath_paths(votes, candidates):
+    r'''Reference implementation of beatpath(), enumerating every path.
+        Takes exponential time in dense graphs; kept for verification.
+    '''#"""#'''
+    majorities = pairwise(votes, candidates)
+    graph = Graph(candidates)
+    for a, b in majorities:
+        graph.edge(a, b)
+    
+    def path_steps(path):
+        sequence = iter(path)
+        prev = next(sequence)
+        for item in sequence:
+            yield prev, item
+            prev = item
+    
+    def beat_strength(source, sink):
+        # max() doesn't like empty iterables.
+        strength = 0
+        for path in graph.paths(source, sink):
+            path_strength = min(majorities[step]
+                for step in path_steps(path))
+            if path_strength > strength:
+                strength = path_strength
+        return strength
+    
+    final = Graph(candidates)
+    for source, sink in pairs(candidates):
+        major = beat_strength(sink, source)
+        minor = beat_strength(source, sink)
+        if major > minor:
+            final.edge(sink, source)
+        elif minor > major:
+            final.edge(source, sink)
+    
+    while final:
+        winners = final.pop()
+        yield winners
@@ -1,4 +1,13 @@
+import logging
+from collections import defaultdict
+from datetime import datetime
+from hashlib import sha1
+from random import randrange
+from time import sleep, time
+from google.appengine.api import datastore, datastore_errors, memcache
 from google.appengine.ext import db
+from voting import cache, codec, stats
+from voting.methods import PairwiseMatrix, Tally, methods
 
 class Election(db.Model):
     creator = db.UserProperty()
@@ -9,6 +18,9 @@ class Election(db.Model):
     closes = db.DateTimeProperty()
     public = db.BooleanProperty(default=False)
     approved = db.BooleanProperty(default=False)
+    finalized = db.BooleanProperty(default=False)
+    # The number of winners, for methods that elect several at once.
+    seats = db.IntegerProperty(default=1)
 
 class Candidate(db.Model):
     title = db.StringProperty()
@@ -17,7 +29,488 @@ class Candidate(db.Model):
 class Vote(db.Model):
     election = db.ReferenceProperty(Election, required=True)
     voter = db.UserProperty(required=True)
-    ranks = db.StringProperty(required=True)
+    # Candidate ids in ranked order, and the number of equally-ranked
+    # candidates in each successive group of them.
+    choices = db.ListProperty(long)
+    groups = db.ListProperty(long)
+    # Older votes hold ranks in either format read by parse_ranks()
+    # instead, until migrate_votes() rewrites them.
+    ranks = db.ByteStringProperty()
     created = db.DateTimeProperty(auto_now_add=True)
     modified = db.DateTimeProperty(auto_now_add=True)
+    
+    @staticmethod
+    def columns(ranks):
+        r'''Flatten a ranking into values for the list properties.
+            Returns a dictionary of the choices and groups.
+        '''#"""#'''
+        choices = []
+        groups = []
+        for rank in ranks:
+            if rank:
+                choices.extend(sorted(long(key) for key in rank))
+                groups.append(long(len(rank)))
+        return dict(choices=choices, groups=groups)
+    
+    def rankings(self):
+        r'''Collect the ranks as lists of candidate ids, from either schema.
+        '''#"""#'''
+        if self.ranks is not None:
+            return parse_ranks(self.ranks)
+        result = []
+        start = 0
+        for size in self.groups:
+            result.append(self.choices[start:start+size])
+            start += size
+        return result
+    
+    def store(self, ranks):
+        r'''Replace the ranking, in the list properties.
+        '''#"""#'''
+        columns = self.columns(ranks)
+        self.choices = columns["choices"]
+        self.groups = columns["groups"]
+        self.ranks = None
 
+def parse_ranks(ranks):
+    r'''Splits stored ranks into lists of candidate ids.
+        Accepts both the binary format from codec.encode()
+        and ranks strings, such as "12,15;9".
+    '''#"""#'''
+    return codec.read(ranks)
+
+def format_ranks(ranks):
+    r'''Joins a sequence of ranks of candidate ids into a ranks string.
+        The inverse of parse_ranks().
+    '''#"""#'''
+    return ";".join(",".join(map(str, sorted(rank))) for rank in ranks)
+
+def canonical_ranks(ranks):
+    r'''Normalizes stored ranks in either format into a ranks string,
+        sorting the candidate ids within each rank numerically.
+    '''#"""#'''
+    return format_ranks(parse_ranks(ranks))
+
+class BatchLoader(object):
+    r'''Iterates over the results of a query in large batches,
+        following cursors, so that only one batch is held at a time.
+        `trips` counts the datastore round trips taken so far.
+    '''#"""#'''
+    size = 500
+    
+    def __init__(self, query, size=None):
+        self.query = query
+        self.size = size or self.size
+        self.trips = 0
+    
+    def __iter__(self):
+        while True:
+            batch = self.query.fetch(self.size)
+            self.trips += 1
+            for entity in batch:
+                yield entity
+            if len(batch) < self.size:
+                break
+            self.query.with_cursor(self.query.cursor())
+
+def vote_loader(election, size=None):
+    r'''Creates a BatchLoader over the votes in an election.
+    '''#"""#'''
+    # Projection queries would split the list properties
+    # into one result per value, so whole votes are loaded.
+    return BatchLoader(Vote.all().filter("election =", election), size)
+
+class Migration(db.Model):
+    r'''Progress of a resumable batch migration, keyed by its name.
+        `cursor` marks where the next batch starts.
+    '''#"""#'''
+    cursor = db.TextProperty()
+    scanned = db.IntegerProperty(default=0)
+    migrated = db.IntegerProperty(default=0)
+    finished = db.BooleanProperty(default=False)
+    updated = db.DateTimeProperty(auto_now=True)
+    
+    def __str__(self):
+        state = self.finished and "finished" or "in progress"
+        return "%s: %s; %d scanned, %d migrated" % (self.key().name(),
+            state, self.scanned, self.migrated)
+
+def migrate(name, model, upgrade, size=100, budget=20, pause=0.5):
+    r'''Run `upgrade` on the key of every entity of the model, each in its
+        own transaction; it returns whether that entity was rewritten.
+        Works through the entities in batches of `size`, pausing `pause`
+        seconds between batches to spare the datastore, until the
+        migration finishes or `budget` seconds have passed.  Progress
+        is saved under `name` after each batch, so later calls resume
+        from there.  Returns the Migration entity.
+    '''#"""#'''
+    progress = Migration.get_or_insert(name)
+    deadline = time() + budget
+    while not progress.finished:
+        query = model.all(keys_only=True)
+        if progress.cursor:
+            query.with_cursor(progress.cursor)
+        batch = query.fetch(size)
+        for key in batch:
+            # Transactions keep a voter's concurrent change from being lost.
+            if db.run_in_transaction(upgrade, key):
+                progress.migrated += 1
+        progress.scanned += len(batch)
+        progress.cursor = query.cursor()
+        progress.finished = len(batch) < size
+        progress.put()
+        logging.info("Migrating %s", progress)
+        
+        if progress.finished or time() + pause > deadline:
+            break
+        sleep(pause)
+    return progress
+
+def migrate_votes(size=100, budget=20, pause=0.5):
+    r'''Rewrite votes from the older ranks property into the list properties.
+        Takes the batching arguments of migrate().
+    '''#"""#'''
+    def upgrade(key):
+        vote = Vote.get(key)
+        if vote is None or vote.ranks is None:
+            return False
+        vote.store(vote.rankings())
+        vote.put()
+        return True
+    return migrate("votes", Vote, upgrade, size, budget, pause)
+
+def migrate_elections(size=100, budget=20, pause=0.5):
+    r'''Store the finalized flag on elections from before it existed,
+        so that the finalizer's query on it can find them.
+        Takes the batching arguments of migrate().
+    '''#"""#'''
+    def upgrade(key):
+        # The model would read the missing property as its default.
+        try:
+            entity = datastore.Get(key)
+        except datastore_errors.EntityNotFoundError:
+            return False
+        if "finalized" in entity:
+            return False
+        entity["finalized"] = False
+        datastore.Put(entity)
+        return True
+    return migrate("elections", Election, upgrade, size, budget, pause)
+
+class Counts(object):
+    r'''Methods shared by the entities holding pairwise counts.
+        `counts` is the flat matrix for the candidate ids in `candidates`,
+        and `ballots` the number of ballots counted.
+    '''#"""#'''
+    
+    def matrix(self):
+        return PairwiseMatrix(self.candidates, self.counts)
+    
+    def store(self, matrix):
+        self.candidates = [long(key) for key in matrix.candidates]
+        self.counts = [long(count) for count in matrix.tolist()]
+    
+    def apply(self, previous, current):
+        r'''Replace one ballot's contribution with another, and move the
+            voter between ballot buckets; call within a transaction.
+            `previous` and `current` are stored ranks, or None.
+        '''#"""#'''
+        keys = set(self.candidates)
+        for ranks in (previous, current):
+            if ranks:
+                for rank in parse_ranks(ranks):
+                    keys.update(rank)
+        
+        matrix = self.matrix().restricted(sorted(keys))
+        if previous:
+            matrix.add(parse_ranks(previous), -1)
+            self.ballots -= 1
+            BallotBucket.move(self, previous, -1)
+        if current:
+            matrix.add(parse_ranks(current), 1)
+            self.ballots += 1
+            BallotBucket.move(self, current, +1)
+        self.store(matrix)
+
+class PairwiseTally(Counts, db.Model):
+    r'''Running pairwise preference counts for an election.
+        Keyed by the election's key name, so that the pairwise methods
+        can run without loading any ballots.  Votes add their changes to
+        the TallyShard entities instead; current() merges them in.
+    '''#"""#'''
+    # Never queried; indexing them would write up to n*n index rows a vote.
+    candidates = db.ListProperty(long, indexed=False)
+    counts = db.ListProperty(long, indexed=False)
+    ballots = db.IntegerProperty(default=0)
+    
+    @classmethod
+    def create(cls, election):
+        r'''Start an empty tally for a new election.
+        '''#"""#'''
+        tally = cls(key_name=election.key().name())
+        tally.put()
+        return tally
+    
+    @classmethod
+    def fetch(cls, election):
+        r'''Collect the stored tally for the election.
+            Elections predating the stored tallies are rebuilt
+            from their votes the first time.
+        '''#"""#'''
+        tally = cls.get_by_key_name(election.key().name())
+        if tally is None:
+            tally = cls.rebuild(election)
+        return tally
+    
+    @classmethod
+    def current(cls, election):
+        r'''Collect the election's counts, with every shard merged in.
+            Merged counts are cached until the next vote or candidate.
+            Returns an unsaved PairwiseTally; don't put() it.
+        '''#"""#'''
+        slug = election.key().name()
+        key = "tally:%s:%s" % (slug, cache.version(slug))
+        found = memcache.get(key)
+        if found is not None:
+            candidates, counts, ballots = found
+            return cls(key_name=slug, candidates=candidates, counts=counts, ballots=ballots)
+        
+        parts = [cls.fetch(election)] + TallyShard.all_shards(election)
+        keys = set()
+        for part in parts:
+            keys.update(part.candidates)
+        keys = sorted(keys)
+        totals = [0] * (len(keys) * len(keys))
+        for part in parts:
+            counts = part.matrix().restricted(keys).tolist()
+            totals = [a + b for a, b in zip(totals, counts)]
+        
+        merged = cls(key_name=slug)
+        merged.store(PairwiseMatrix(keys, totals))
+        merged.ballots = sum(part.ballots for part in parts)
+        memcache.set(key, (merged.candidates, merged.counts, merged.ballots))
+        return merged
+    
+    @classmethod
+    def turnout(cls, election):
+        r'''The number of voters in the election.
+        '''#"""#'''
+        return cls.current(election).ballots
+    
+    @classmethod
+    def load(cls, election, candidates):
+        r'''Collect a Tally for the election from its stored counts.
+            `candidates` is the current sequence of candidate ids.
+        '''#"""#'''
+        tally = cls.current(election)
+        return Tally.from_matrix(tally.matrix().restricted(candidates))
+    
+    @classmethod
+    def rebuild(cls, election):
+        r'''Recount the stored tally and ballot buckets
+            from every vote in the election, discarding any shards.
+        '''#"""#'''
+        TallyShard.clear(election)
+        # Store the tally before scanning, so that votes cast meanwhile
+        # add their changes to a shard, instead of relying on a query
+        # that may not see them yet.  Votes already in transactions
+        # retry when this write conflicts with their read of it.
+        cls(key_name=election.key().name()).put()
+        counts = defaultdict(int)
+        keys = set()
+        votes = vote_loader(election)
+        for vote in votes:
+            ranks = format_ranks(vote.rankings())
+            counts[ranks] += 1
+            for rank in parse_ranks(ranks):
+                keys.update(rank)
+        logging.info("Recounted %s in %d round trips", election.key().name(), votes.trips)
+        stats.count("load.trips", votes.trips)
+        
+        tally = Tally([(parse_ranks(ranks), counts[ranks]) for ranks in counts], sorted(keys))
+        stored = cls(key_name=election.key().name())
+        stored.store(tally.matrix())
+        stored.ballots = tally.total()
+        stored.put()
+        
+        buckets = [BallotBucket(parent=stored, key_name=BallotBucket.bucket_name(ranks),
+                ranks=ranks, count=counts[ranks]) for ranks in counts]
+        for start in range(0, len(buckets), 500):
+            db.put(buckets[start:start+500])
+        return stored
+
+class TallyShard(Counts, db.Model):
+    r'''One shard of the changes to an election's counts.
+        Each vote adds its change to a random shard, in the same
+        transaction as the vote itself, so that concurrent voters rarely
+        write to the same entity group.  Counts in a shard may be negative
+        when a voter's earlier ballot was counted in another one.
+        Keyed by the election's key name and the shard number.
+    '''#"""#'''
+    # Never queried; indexing them would write up to n*n index rows a vote.
+    candidates = db.ListProperty(long, indexed=False)
+    counts = db.ListProperty(long, indexed=False)
+    ballots = db.IntegerProperty(default=0)
+    
+    # The number of shards per election.
+    shards = 20
+    
+    @classmethod
+    def shard_names(cls, election):
+        slug = election.key().name()
+        return ["%s/%d" % (slug, n) for n in range(cls.shards)]
+    
+    @classmethod
+    def pick(cls, election):
+        r'''Choose a random shard, returning its key name.
+        '''#"""#'''
+        return "%s/%d" % (election.key().name(), randrange(cls.shards))
+    
+    @classmethod
+    def all_shards(cls, election):
+        r'''Collect the election's existing shards.
+        '''#"""#'''
+        return [shard for shard in cls.get_by_key_name(cls.shard_names(election)) if shard]
+    
+    @classmethod
+    def clear(cls, election):
+        r'''Delete the election's shards and the buckets they hold.
+        '''#"""#'''
+        keys = []
+        for shard in cls.all_shards(election):
+            # Ancestor queries are strongly consistent, so none are missed.
+            keys.extend(BallotBucket.all(keys_only=True).ancestor(shard))
+            keys.append(shard.key())
+        db.delete(keys)
+
+def cast_vote(election, key, voter, ranks):
+    r'''Store a voter's ranking, and add the change to a random shard
+        of the election's counts in the same transaction.
+        `key` is the vote's key name, and `ranks` a sequence of ranks
+        of candidate ids.  Elections without a stored tally only store
+        the vote, leaving the counts for PairwiseTally.fetch() to rebuild.
+        Returns True if the ranking changed.
+    '''#"""#'''
+    ranked = codec.encode(ranks)
+    shard = TallyShard.pick(election)
+    
+    def cast():
+        # Read within the transaction, so that a concurrent rebuild
+        # storing the tally forces a retry instead of a lost count.
+        counted = PairwiseTally.get_by_key_name(election.key().name()) is not None
+        vote = Vote.get_by_key_name(key)
+        if vote is None:
+            previous = None
+            vote = Vote(key_name=key, election=election, voter=voter, **Vote.columns(ranks))
+        else:
+            previous = codec.encode(vote.rankings())
+            if previous == ranked and vote.ranks is None:
+                return False
+            # Changed, or stored in the older schema.
+            vote.store(ranks)
+            vote.modified = datetime.now()
+        
+        if previous != ranked and counted:
+            counts = TallyShard.get_by_key_name(shard) or TallyShard(key_name=shard)
+            counts.apply(previous, ranked)
+            db.put([vote, counts])
+        else:
+            vote.put()
+        return previous != ranked
+    
+    # The vote, the tally, and the shard are separate entity groups.
+    options = db.create_transaction_options(xg=True)
+    return db.run_in_transaction_options(options, cast)
+
+class BallotBucket(db.Model):
+    r'''The number of voters casting one distinct ranking in an election.
+        Stored under the election's PairwiseTally or one of its shards,
+        so that moving a voter between buckets shares its transaction.
+        Tabulating from the buckets reads one entity per distinct ballot
+        and shard, not per voter.
+    '''#"""#'''
+    # Full ballots in large elections outgrow the limits on key names
+    # and indexed strings, so the ranks are neither.
+    ranks = db.TextProperty(required=True)
+    count = db.IntegerProperty(default=0)
+    
+    @staticmethod
+    def bucket_name(ranks):
+        # Key names may not begin with a digit.
+        return "r" + sha1(codec.encode(parse_ranks(ranks))).hexdigest()
+    
+    @classmethod
+    def move(cls, tally, ranks, delta):
+        r'''Adjust the count for a ranking; call within a transaction.
+            Empty buckets are deleted.
+        '''#"""#'''
+        ranks = canonical_ranks(ranks)
+        name = cls.bucket_name(ranks)
+        bucket = cls.get_by_key_name(name, parent=tally)
+        if bucket is None:
+            bucket = cls(parent=tally, key_name=name, ranks=ranks)
+        bucket.count += delta
+        if bucket.count:
+            bucket.put()
+        elif bucket.is_saved():
+            bucket.delete()
+    
+    @classmethod
+    def load(cls, election, candidates):
+        r'''Collect a Tally for the election from its ballot buckets.
+            `candidates` is the current sequence of candidate ids.
+        '''#"""#'''
+        tally = PairwiseTally.fetch(election)
+        counts = defaultdict(int)
+        trips = 0
+        # One ancestor query per entity group, because they are strongly
+        # consistent: a recount right after a vote must see its buckets.
+        for parent in [tally] + TallyShard.all_shards(election):
+            buckets = BatchLoader(cls.all().ancestor(parent))
+            for bucket in buckets:
+                counts[bucket.ranks] += bucket.count
+            trips += buckets.trips
+        logging.info("Tabulated %s in %d round trips", election.key().name(), trips)
+        stats.count("load.trips", trips)
+        
+        ballots = [(parse_ranks(ranks), counts[ranks]) for ranks in counts if counts[ranks] > 0]
+        return Tally(ballots, candidates)
+
+class Result(db.Model):
+    r'''Final results of a closed election, for every voting method.
+        Keyed by the election's key name.  `methods` holds the method
+        function names, and `ranks` the ordering each one produced,
+        as a ranks string.
+    '''#"""#'''
+    election = db.ReferenceProperty(Election, required=True)
+    computed = db.DateTimeProperty(auto_now_add=True)
+    methods = db.StringListProperty()
+    ranks = db.StringListProperty()
+    
+    def ordering(self, name):
+        r'''Collect the ranks for a method, as lists of candidate ids.
+        '''#"""#'''
+        return parse_ranks(self.ranks[self.methods.index(name)])
+    
+    @classmethod
+    def finalize(cls, election):
+        r'''Compute and store every method's results for an election,
+            then mark the election as finalized.
+        '''#"""#'''
+        candidates = [key.id() for key in
+            Candidate.all(keys_only=True).ancestor(election)]
+        tally = BallotBucket.load(election, candidates)
+        
+        result = cls(key_name=election.key().name(), election=election)
+        for name in sorted(methods):
+            method = methods[name]
+            options = {}
+            if method.multiwinner:
+                options["seats"] = election.seats
+            result.methods.append(method.__name__)
+            result.ranks.append(format_ranks(method(tally, candidates, **options)))
+        result.put()
+        
+        election.finalized = True
+        election.put()
+        return result
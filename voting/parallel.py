@@ -0,0 +1,134 @@
+r'''Parallel evaluation of the registered voting methods.
+    Comparison reports run every method over the same ballots, and the
+    slowest methods dominate the wall clock when run one after another.
+    This module fans them out over a process pool instead, falling back
+    to serial evaluation where multiprocessing is unavailable.
+'''#"""#'''
+
+import marshal
+from time import time
+
+from voting.methods import Tally, methods
+
+try:
+    import multiprocessing
+except ImportError:
+    # Python 2.5 and the App Engine runtime lack this module.
+    multiprocessing = None
+
+class Evaluation(object):
+    r'''The outcome of running one voting method.
+        `ranks` is the list of ranks, each a set of candidate keys,
+        or None if the method failed or timed out.
+        `seconds` is the time the method took, as measured where it ran.
+        `error` describes any failure, or is None.
+    '''#"""#'''
+    
+    def __init__(self, name, ranks=None, seconds=None, error=None):
+        self.name = name
+        self.ranks = ranks
+        self.seconds = seconds
+        self.error = error
+    
+    def __repr__(self):
+        return "Evaluation(%r, %r, %r, %r)" % (self.name, self.ranks, self.seconds, self.error)
+
+def serialize(votes, candidates):
+    r'''Encodes ballots compactly for sending to worker processes.
+        Candidates are replaced by their index in the `candidates` list,
+        and identical ballots are merged first.
+        Returns a string accepted by deserialize().
+    '''#"""#'''
+    candidates = list(candidates)
+    indexes = dict((key, n) for n, key in enumerate(candidates))
+    ballots = tuple((tuple(tuple(indexes[key] for key in row) for row in ranks), count)
+        for ranks, count in Tally(votes, candidates))
+    return marshal.dumps((len(candidates), ballots))
+
+def deserialize(data):
+    r'''Decodes the output of serialize().
+        Returns a Tally over the candidate indexes.
+    '''#"""#'''
+    size, ballots = marshal.loads(data)
+    return Tally(ballots, range(size))
+
+# The ballots for the current worker process, set by _load().
+_tally = None
+
+def _load(data):
+    global _tally
+    _tally = deserialize(data)
+
+def _run(name, tally):
+    start = time()
+    ranks = [sorted(rank) for rank in methods[name](tally, tally.candidates)]
+    return ranks, time() - start
+
+def _work(name):
+    return _run(name, _tally)
+
+def evaluate(votes, candidates, names=None, timeout=None, processes=None):
+    r'''Runs several voting methods over the same ballots.
+        `names` lists the registered method names to run; all by default.
+        `timeout` is the total budget, in seconds from the start of the
+        batch, for every method to finish in parallel mode; methods still
+        running then, or still queued for a worker, are reported as timed
+        out.  With fewer processes than methods, the queued methods get
+        whatever remains of the budget when a worker frees up.
+        `processes` is the size of the process pool, defaulting to one per
+        method; zero forces serial evaluation, which ignores the timeout.
+        Returns a dictionary of method name => Evaluation.
+    '''#"""#'''
+    candidates = list(candidates)
+    if names is None:
+        names = list(methods)
+    if processes is None:
+        processes = len(names)
+    
+    data = serialize(votes, candidates)
+    pool = None
+    if multiprocessing is not None and processes > 0 and names:
+        try:
+            pool = multiprocessing.Pool(processes, _load, (data,))
+        except (OSError, ImportError):
+            # Some sandboxes forbid the semaphores or processes it needs.
+            pool = None
+    
+    results = {}
+    if pool is None:
+        tally = deserialize(data)
+        for name in names:
+            try:
+                ranks, seconds = _run(name, tally)
+            except Exception, err:
+                results[name] = Evaluation(name, error=repr(err))
+            else:
+                results[name] = Evaluation(name, ranks, seconds)
+    else:
+        try:
+            # The timeout covers the whole batch, not each method.
+            started = time()
+            pending = [(name, pool.apply_async(_work, (name,))) for name in names]
+            for name, result in pending:
+                if timeout is None:
+                    wait = None
+                else:
+                    wait = max(0, started + timeout - time())
+                try:
+                    ranks, seconds = result.get(wait)
+                except multiprocessing.TimeoutError:
+                    results[name] = Evaluation(name, error="timed out")
+                except Exception, err:
+                    results[name] = Evaluation(name, error=repr(err))
+                else:
+                    results[name] = Evaluation(name, ranks, seconds)
+        finally:
+            # Terminating also stops any methods that timed out.
+            pool.terminate()
+            pool.join()
+    
+    for name in results:
+        ranks = results[name].ranks
+        if ranks is not None:
+            results[name].ranks = [set(candidates[n] for n in rank) for rank in ranks]
+    return results
@@ -0,0 +1,72 @@
+r'''Optional instrumentation for the voting methods.
+    The methods report phase timings and counters through the functions
+    here, which do nothing unless a Collector has been installed with
+    collect().  Counters are accumulated locally within each method and
+    reported once, so disabled instrumentation costs a few function calls
+    per tabulation, not per ballot.
+'''#"""#'''
+
+from time import time
+
+class Collector(object):
+    r'''Accumulates the timings and counters reported during tabulation.
+        `timings` maps phase names to total seconds,
+        and `counts` maps counter names to totals.
+    '''#"""#'''
+    
+    def __init__(self):
+        self.timings = {}
+        self.counts = {}
+    
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+    
+    def timing(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0) + seconds
+    
+    def report(self):
+        r'''Formats the collected statistics, one per line.
+        '''#"""#'''
+        lines = ["%s: %.2f ms" % (name, self.timings[name] * 1000)
+            for name in sorted(self.timings)]
+        lines.extend("%s: %d" % (name, self.counts[name])
+            for name in sorted(self.counts))
+        return "\n".join(lines)
+    
+    __str__ = report
+    
+    def __nonzero__(self):
+        return bool(self.timings or self.counts)
+
+# The installed Collector, or None when instrumentation is disabled.
+collector = None
+
+def collect(new):
+    r'''Install a Collector, or None to disable instrumentation.
+        Returns the previously installed one, for restoring afterwards.
+    '''#"""#'''
+    global collector
+    previous = collector
+    collector = new
+    return previous
+
+def count(name, amount=1):
+    r'''Add to a counter, if instrumentation is enabled.
+    '''#"""#'''
+    if collector is not None:
+        collector.count(name, amount)
+
+def _ignore():
+    pass
+
+def phase(name):
+    r'''Start timing a phase, if instrumentation is enabled.
+        Returns a function to call when the phase ends.
+    '''#"""#'''
+    if collector is None:
+        return _ignore
+    target = collector
+    start = time()
+    def done():
+        target.timing(name, time() - start)
+    return done